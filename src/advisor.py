@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# Probability engine behind the bot seats and !hint. Estimates are computed by
+# simulating the rest of the round and memoized in an LRU cache keyed by the
+# situation, so repeated situations are answered without simulating again.
+
+import asyncio
+import math
+import threading
+from collections import OrderedDict, namedtuple
+from random import Random
+from engine import NB_OF_CARDS, JOKER, TurnState, Call, Play, cardsOf
+
+CACHE_SIZE = 50000
+SAMPLES = 200
+
+# expectedFolds[c] and penalties[c] (expected |c - folds|) when calling c
+Estimate = namedtuple('Estimate', ['expectedFolds', 'penalties'])
+
+
+# Probability that card c (index = card) beats the cards of the other players
+# when they are drawn among the 21 other cards
+def winProbabilities(nbOfPlayers):
+    others = nbOfPlayers - 1
+    total = math.comb(NB_OF_CARDS - 1, others)
+    probabilities = [math.comb(max(card - 1, 0), others) / total for card in range(NB_OF_CARDS + 1)]
+    probabilities[JOKER] = 1.0
+    return probabilities
+
+
+def guessCall(cards, nbOfCards, probabilities):
+    return min(nbOfCards, int(round(sum(probabilities[card] for card in cards))))
+
+
+# Card to play from sorted cards. 0 is the joker played low.
+def pickCard(cards, wantsFold, highestCard):
+    if wantsFold:
+        for card in cards:
+            if card > highestCard:
+                return card  # cheapest card taking the fold
+    else:
+        dump = [card for card in cards if card < highestCard]
+        if dump:
+            return dump[-1]  # highest card still losing
+        if cards[-1] == JOKER:
+            return 0
+    return cards[0]
+
+
+# Plays a round where every player targets his call, returns the folds of each position
+def playOut(hands, calls):
+    nbOfPlayers = len(hands)
+    hands = [sorted(hand) for hand in hands]
+    folds = [0] * nbOfPlayers
+    leader = 0
+    for fold in range(len(hands[0])):
+        highestCard = 0
+        owner = leader
+        for offset in range(nbOfPlayers):
+            position = (leader + offset) % nbOfPlayers
+            card = pickCard(hands[position], folds[position] < calls[position], highestCard)
+            hands[position].remove(card or JOKER)
+            if card > highestCard:
+                highestCard = card
+                owner = position
+        folds[owner] += 1
+        leader = owner
+    return folds
+
+
+class ProbabilityEngine:
+    def __init__(self, maxSize=CACHE_SIZE, samples=SAMPLES, seed=None):
+        self.cache = OrderedDict()
+        self.maxSize = maxSize
+        self.samples = samples
+        self.rng = Random(seed)
+        self.lock = threading.Lock()  # estimate() also runs in executor threads
+        self.hits = 0
+        self.misses = 0
+
+    def getCached(self, hand, position, nbOfPlayers, nbOfCards, calls):
+        key = (hand, position, nbOfPlayers, nbOfCards, tuple(calls))
+        with self.lock:
+            estimate = self.cache.get(key)
+            if estimate is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+            return estimate
+
+    # hand is the bitmask of the player's cards, or of the cards he sees on the
+    # others' foreheads on the blind turn (nbOfCards == 0)
+    def estimate(self, hand, position, nbOfPlayers, nbOfCards, calls):
+        estimate = self.getCached(hand, position, nbOfPlayers, nbOfCards, calls)
+        if estimate is not None:
+            return estimate
+        if nbOfCards == 0:
+            estimate = self.__estimateBlindTurn(hand, nbOfPlayers)
+        else:
+            estimate = self.__simulate(hand, position, nbOfPlayers, nbOfCards, calls)
+        with self.lock:
+            self.misses += 1
+            self.cache[(hand, position, nbOfPlayers, nbOfCards, tuple(calls))] = estimate
+            if len(self.cache) > self.maxSize:
+                self.cache.popitem(last=False)
+        return estimate
+
+    # Cache hits are answered right away, simulations run in a thread so the
+    # other tables keep playing
+    async def estimateAsync(self, situation):
+        estimate = self.getCached(*situation)
+        if estimate is None:
+            estimate = await asyncio.get_event_loop().run_in_executor(None, self.estimate, *situation)
+        return estimate
+
+    def __estimateBlindTurn(self, seen, nbOfPlayers):
+        unseen = NB_OF_CARDS - 1 - (nbOfPlayers - 1)
+        chance = (NB_OF_CARDS - 1 - max(cardsOf(seen))) / unseen
+        return Estimate((chance, chance), (chance, 1 - chance))
+
+    def __simulate(self, hand, position, nbOfPlayers, nbOfCards, calls):
+        myCards = cardsOf(hand)
+        deck = [card for card in range(1, NB_OF_CARDS + 1) if not hand >> card & 1]
+        probabilities = winProbabilities(nbOfPlayers)
+        foldsSum = [0] * (nbOfCards + 1)
+        penaltiesSum = [0] * (nbOfCards + 1)
+        for sample in range(self.samples):
+            drawn = self.rng.sample(deck, (nbOfPlayers - 1) * nbOfCards)
+            hands = [drawn[other * nbOfCards:(other + 1) * nbOfCards] for other in range(nbOfPlayers - 1)]
+            hands.insert(position, myCards)
+            otherCalls = [calls[other] if other < len(calls) else guessCall(hands[other], nbOfCards, probabilities)
+                          for other in range(nbOfPlayers)]
+            for call in range(nbOfCards + 1):
+                otherCalls[position] = call
+                folds = playOut(hands, otherCalls)[position]
+                foldsSum[call] += folds
+                penaltiesSum[call] += abs(call - folds)
+        return Estimate(tuple(folds / self.samples for folds in foldsSum),
+                        tuple(penalty / self.samples for penalty in penaltiesSum))
+
+
+probabilityEngine = ProbabilityEngine()
+
+
+# Arguments of ProbabilityEngine.estimate for a player of the table
+def getSituation(state, name):
+    position = state.getPlayerPosition(name)
+    nbOfPlayers = len(state.seats)
+    if state.currentTurn == 0:
+        hand = 0
+        for player in state.seats:
+            if player.name != name:
+                hand |= player.hand
+    else:
+        hand = state.getPlayerByName(name).hand
+    calledSoFar = min(position, state.currentPlayer) if state.turnState == TurnState.CALLING else position
+    calls = [state.seatAt(other).call for other in range(calledSoFar)]
+    return hand, position, nbOfPlayers, state.currentTurn, calls
+
+
+# Calls that the rules allow for this player
+def getAllowedCalls(state, name):
+    calls = range(max(state.currentTurn, 1) + 1)
+    if state.getPlayerPosition(name) == len(state.seats) - 1:
+        return [call for call in calls if state.sumOfCalls + call != state.maxNbOfCalls]
+    return list(calls)
+
+
+def adviseCall(estimate, allowedCalls):
+    return min(allowedCalls, key=lambda call: estimate.penalties[call])
+
+
+async def chooseCall(state, name, engine=probabilityEngine):
+    estimate = await engine.estimateAsync(getSituation(state, name))
+    return Call(name, adviseCall(estimate, getAllowedCalls(state, name)))
+
+
+def choosePlay(state, name):
+    player = state.getPlayerByName(name)
+    return Play(name, pickCard(player.cards, player.foldTaken < player.call, state.highestCard))
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+# Columnar history of the games for offline analysis: one row per call (with
+# the folds taken, written when the turn is scored) and one row per card played
+# (written when the fold is won). Each column is a raw little-endian file that
+# only grows, in chunk directories rotated every CHUNK_BYTES, and the reader
+# memory-maps them so millions of rows are scanned chunk by chunk.
+#
+# python analytics.py calls | seats | jokers
+# python analytics.py backfill archives (rows of the games archived before)
+
+import argparse
+import asyncio
+import os
+import time
+from array import array
+from collections import defaultdict
+from batch import BatchWriter
+from engine import JOKER, TableState, EventType, apply
+from journal import toAction, listArchives, readArchive
+
+try:
+    import numpy as np
+except ImportError:  # only the reader needs it, the bot writes without
+    np = None
+
+STATS_DIR = 'stats'
+CHUNK_BYTES = 16 * 2 ** 20
+WRITE_DELAY = 1.0
+
+# position is the calling order (0 = dealer, first to call), turn the number of
+# cards dealt (0 for the blind last turn), card the value played (0 for the
+# joker played low, JOKER for the joker played high)
+SCHEMAS = {
+    'calls': (('game', '<i8'), ('guild', '<i8'), ('nbOfPlayers', '<i1'), ('turn', '<i1'), ('position', '<i1'),
+              ('call', '<i1'), ('foldTaken', '<i1')),
+    'plays': (('game', '<i8'), ('guild', '<i8'), ('nbOfPlayers', '<i1'), ('turn', '<i1'), ('fold', '<i1'),
+              ('order', '<i1'), ('position', '<i1'), ('card', '<i1'), ('won', '?')),
+}
+# array typecodes of the dtypes, for a little-endian machine
+TYPECODES = {'<i8': 'q', '<i1': 'b', '?': 'B'}
+LIMITS = {'<i8': (-2 ** 63, 2 ** 63 - 1), '<i1': (-128, 127), '?': (0, 1)}
+
+
+def getGameId(seed):
+    return seed & (2 ** 63 - 1)  # the archived game is the one with this seed
+
+
+class ColumnWriter:
+    def __init__(self, directory=STATS_DIR, chunkBytes=CHUNK_BYTES):
+        self.directory = directory
+        self.chunkBytes = chunkBytes
+        self.chunks = {}
+        self.chunkNumber = 0
+        self.writer = BatchWriter(self.write, WRITE_DELAY)
+
+    # A row that doesn't fit its columns is dropped, it would fail the whole batch
+    def append(self, kind, row):
+        for (column, dtype), value in zip(SCHEMAS[kind], row):
+            low, high = LIMITS[dtype]
+            if not low <= value <= high:
+                print("Ligne " + kind + " ignorée, " + column + " = " + str(value))
+                return
+        self.writer.append((kind, row))
+
+    async def flush(self):
+        await self.writer.flush()
+
+    def write(self, items):
+        rows = {kind: [] for kind in SCHEMAS}
+        for kind, row in items:
+            rows[kind].append(row)
+        for kind, kindRows in rows.items():
+            if kindRows:
+                self.__writeRows(kind, kindRows)
+
+    # Only the io thread writes, a new chunk starts when the current one is full.
+    # Every column is converted before any is written, so the columns of a chunk
+    # always have the same length.
+    def __writeRows(self, kind, rows):
+        columns = [(column, array(TYPECODES[dtype], values))
+                   for (column, dtype), values in zip(SCHEMAS[kind], zip(*rows))]
+        path, size = self.chunks.get(kind, (None, self.chunkBytes))
+        if size >= self.chunkBytes:
+            self.chunkNumber += 1
+            path = os.path.join(self.directory, kind + '-' + time.strftime('%Y%m%d-%H%M%S') + '-'
+                                + str(os.getpid()) + '-' + str(self.chunkNumber))
+            os.makedirs(path, exist_ok=True)
+            size = 0
+        self.chunks[kind] = (path, self.chunkBytes)  # a write failing halfway leaves this chunk for a new one
+        for column, data in columns:
+            with open(os.path.join(path, column + '.bin'), 'ab') as file:
+                data.tofile(file)
+            size += len(data) * data.itemsize
+        self.chunks[kind] = (path, size)
+
+
+columnWriter = ColumnWriter()
+
+
+# Turns the events of one game into rows. The cards of a fold are kept until
+# the fold is won.
+class GameRecorder:
+    def __init__(self, writer, game, guild):
+        self.writer = writer
+        self.game = game
+        self.guild = guild or 0
+        self.fold = []
+
+    def onEvent(self, event):
+        view = event.view
+        if event.type == EventType.CARD_PLAYED:
+            positions = [player.name for player in view.players]
+            self.fold.append((sum(player.foldTaken for player in view.players), len(self.fold),
+                              positions.index(event.name), int(event.card)))
+        elif event.type == EventType.FOLD_WON:
+            winner = [player.name for player in view.players].index(event.name)
+            for fold, order, position, card in self.fold:
+                self.writer.append('plays', (self.game, self.guild, len(view.players), view.currentTurn, fold,
+                                             order, position, card, position == winner))
+            self.fold = []
+        elif event.type == EventType.LAST_TURN:
+            for position, player in enumerate(view.players):
+                self.writer.append('plays', (self.game, self.guild, len(view.players), 0, 0, position, position,
+                                             int(player.cardPlayed), player.name == event.name))
+        if event.type in (EventType.TURN_SCORED, EventType.LAST_TURN):
+            for position, player in enumerate(view.players):
+                self.writer.append('calls', (self.game, self.guild, len(view.players), view.currentTurn, position,
+                                             player.call, player.foldTaken))
+
+
+def listChunks(directory, kind):
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.startswith(kind + '-')]
+
+
+# Columns of a chunk as read-only memory maps. A crash can leave the last row
+# written in some columns only, it is ignored.
+def openChunk(path, kind, columns=None):
+    dtypes = dict(SCHEMAS[kind])
+    arrays = {}
+    for column in columns or dtypes:
+        fileName = os.path.join(path, column + '.bin')
+        if not os.path.exists(fileName) or os.path.getsize(fileName) < np.dtype(dtypes[column]).itemsize:
+            return {}
+        arrays[column] = np.memmap(fileName, dtype=dtypes[column], mode='r')
+    length = min(len(array) for array in arrays.values())
+    return {column: array[:length] for column, array in arrays.items()}
+
+
+class ColumnStore:
+    def __init__(self, directory=STATS_DIR):
+        self.directory = directory
+
+    def scan(self, kind, columns=None):
+        for path in listChunks(self.directory, kind):
+            chunk = openChunk(path, kind, columns)
+            if chunk:
+                yield chunk
+
+    # {(values of the by columns): (rows, mean of value)}, value(chunk) and
+    # where(chunk) return an array for the rows of a chunk
+    def aggregate(self, kind, by, value, where=None, columns=None):
+        dtypes = dict(SCHEMAS[kind])
+        counts = defaultdict(int)
+        sums = defaultdict(float)
+        for chunk in self.scan(kind, columns):
+            values = np.asarray(value(chunk), dtype=np.float64)
+            keys = [chunk[column] for column in by]
+            if where:
+                mask = where(chunk)
+                keys, values = [key[mask] for key in keys], values[mask]
+            if all(dtypes[column] in ('<i1', '?') for column in by):
+                # one byte columns are packed in a single code, much faster to sort
+                codes = np.zeros(len(values), dtype=np.int64)
+                for key in keys:
+                    codes = codes * 256 + (key.astype(np.int64) + 128)
+                codes, inverse = np.unique(codes, return_inverse=True)
+                columnsOfGroups = []
+                for column in by:
+                    columnsOfGroups.insert(0, codes % 256 - 128)
+                    codes = codes // 256
+                groups = np.stack(columnsOfGroups, axis=1)
+            else:
+                groups, inverse = np.unique(np.stack([key.astype(np.int64) for key in keys], axis=1), axis=0,
+                                            return_inverse=True)
+            inverse = inverse.reshape(-1)
+            for group, count, total in zip(map(tuple, groups.tolist()), np.bincount(inverse, minlength=len(groups)),
+                                           np.bincount(inverse, weights=values, minlength=len(groups))):
+                counts[group] += int(count)
+                sums[group] += float(total)
+        return {group: (counts[group], sums[group] / counts[group]) for group in sorted(counts)}
+
+
+# Share of calls made exactly
+def getCallAccuracy(store, by=('nbOfPlayers', 'turn')):
+    return store.aggregate('calls', by, lambda chunk: chunk['call'] == chunk['foldTaken'],
+                           columns=by + ('call', 'foldTaken'))
+
+
+# Shit points taken per turn at each position
+def getSeatAdvantage(store, by=('nbOfPlayers', 'position')):
+    return store.aggregate('calls', by, lambda chunk: np.abs(chunk['call'].astype(np.int16) - chunk['foldTaken']),
+                           columns=by + ('call', 'foldTaken'))
+
+
+# How often the joker is played high (JOKER) or low (0), and the share of folds
+# it wins then
+def getJokerUsage(store, by=('card', 'order')):
+    return store.aggregate('plays', by, lambda chunk: chunk['won'],
+                           where=lambda chunk: (chunk['card'] == 0) | (chunk['card'] == JOKER),
+                           columns=tuple(set(by) | {'card', 'won'}))
+
+
+# Rows of games archived before the export existed
+async def backfill(paths, writer):
+    games = 0
+    for path in listArchives(paths):
+        for number, game in readArchive(path):
+            state = TableState(game['seed'])
+            recorder = GameRecorder(writer, getGameId(game['seed']), game.get('guild'))
+            for record in game['records']:
+                state, events = apply(state, toAction(record))
+                for event in events:
+                    recorder.onEvent(event)
+            games += 1
+        await writer.flush()
+    return games
+
+
+def printAggregate(title, by, result, formatMean):
+    print(title)
+    for group, (count, mean) in result.items():
+        print("  " + ', '.join(column + " " + str(value) for column, value in zip(by, group)) + " : "
+              + formatMean(mean) + " (" + str(count) + ")")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse des parties exportées")
+    parser.add_argument('query', choices=('calls', 'seats', 'jokers', 'backfill'))
+    parser.add_argument('paths', nargs='*', default=['archives'], help="archives à exporter (backfill)")
+    parser.add_argument('--dir', default=STATS_DIR)
+    args = parser.parse_args()
+
+    store = ColumnStore(args.dir)
+    start = time.perf_counter()
+    if args.query == 'backfill':
+        games = asyncio.run(backfill(args.paths, ColumnWriter(args.dir)))
+        print(str(games) + " parties exportées")
+    elif args.query == 'calls':
+        printAggregate("Calls réussis :", ('nbOfPlayers', 'turn'), getCallAccuracy(store),
+                       lambda mean: "%.1f%%" % (100 * mean))
+    elif args.query == 'seats':
+        printAggregate("Shit points par tour :", ('nbOfPlayers', 'position'), getSeatAdvantage(store),
+                       lambda mean: "%.3f" % mean)
+    else:
+        printAggregate("Jokers gagnants :", ('card', 'order'), getJokerUsage(store),
+                       lambda mean: "%.1f%%" % (100 * mean))
+    print("%.2f" % (time.perf_counter() - start) + " s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Writes that can wait (journals, archive, leaderboard, column files) are
+# collected and done in batches by a single thread, off the event loop. Every
+# writer shares that thread, so what is written keeps the order it was queued
+# in, and the SQLite connection of the leaderboard always stays in it.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+ioThread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='taraf-io')
+
+
+async def runInIoThread(function, *args):
+    return await asyncio.get_event_loop().run_in_executor(ioThread, function, *args)
+
+
+# write(items) is called in the io thread with the items appended since the
+# last batch, at most delay seconds after the first of them
+class BatchWriter:
+    def __init__(self, write, delay):
+        self.write = write
+        self.delay = delay
+        self.pending = []
+        self.flushTask = None
+
+    def append(self, item):
+        self.pending.append(item)
+        if self.flushTask is None:
+            self.flushTask = asyncio.ensure_future(self.__delayedFlush())
+
+    async def __delayedFlush(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    # Runs even with nothing pending, so it returns after the batches already queued
+    async def flush(self):
+        if self.flushTask and self.flushTask is not asyncio.current_task():
+            self.flushTask.cancel()
+        self.flushTask = None
+        items, self.pending = self.pending, []
+        await runInIoThread(self.__write, items)
+
+    def __write(self, items):
+        if items:
+            self.write(items)
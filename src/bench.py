@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# Microbenchmarks of the hot paths of a game: shuffling and dealing, hand
+# lookups, resolving a whole fold and building embeds, from 2 to 6 players for
+# those that depend on the number of players.
+# Results are compared with the baselines of bench_baseline.json and the run
+# fails when a benchmark got slower than the baseline by more than --threshold.
+# Times are compared relative to a fixed calibration loop timed in the same run,
+# so baselines stay meaningful on a faster or slower machine.
+#
+# python bench.py            compare with the baselines
+# python bench.py --save     store the current results as the new baselines
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+from engine import MIN_PLAYER, MAX_PLAYER, NB_OF_CARDS, TurnState, TableState, Join, Go, Call, Play, apply, \
+    dealCards, firstCard
+from render import getTemplate, buildEmbed
+from taraf import initCallingSummary, initPlayingSummary
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+THRESHOLD = 0.3
+REPEAT = 3
+PASSES = 7
+CALIBRATION = 'calibration'
+SEED = 1
+
+
+# Table of nbOfPlayers seated and called, at the first card of the first fold
+def getPlayingState(nbOfPlayers):
+    state = TableState(SEED)
+    for seat in range(nbOfPlayers):
+        state, events = apply(state, Join("joueur " + str(seat)))
+    state, events = apply(state, Go())
+    while state.turnState == TurnState.CALLING:
+        name = state.seatAt(state.currentPlayer).name
+        call = 0 if state.currentPlayer < nbOfPlayers - 1 or state.sumOfCalls != state.maxNbOfCalls else 1
+        state, events = apply(state, Call(name, call))
+    return state
+
+
+def getFoldActions(state):
+    actions = []
+    for offset in range(len(state.seats)):
+        player = state.seatAt(state.currentPlayer)
+        action = Play(player.name, firstCard(player.hand))
+        actions.append(action)
+        state, events = apply(state, action)
+    return actions
+
+
+def benchShuffle(nbOfPlayers):
+    state = TableState(SEED)
+    return lambda: state.deck.shuffle(NB_OF_CARDS, state.rng)
+
+
+def benchDeal(nbOfPlayers):
+    state = getPlayingState(nbOfPlayers)
+
+    def deal():
+        for player in state.seats:
+            player.hand = 0
+        dealCards(state)
+    return deal
+
+
+def benchHasCard(nbOfPlayers):
+    state = getPlayingState(nbOfPlayers)
+    names = [player.name for player in state.seats]
+
+    def lookup():
+        for name in names:
+            for card in range(1, NB_OF_CARDS + 1):
+                state.doesHeHaveThatCard(name, card)
+    return lookup
+
+
+def benchRemoveCard(nbOfPlayers):
+    player = getPlayingState(nbOfPlayers).seats[0]
+
+    def remove():
+        player.hand = (1 << (NB_OF_CARDS + 1)) - 2
+        for card in range(1, NB_OF_CARDS + 1):
+            player.removeCard(card)
+    return remove
+
+
+def benchFold(nbOfPlayers):
+    state = getPlayingState(nbOfPlayers)
+    actions = getFoldActions(state)
+
+    def fold():
+        current = state
+        for action in actions:
+            current, events = apply(current, action)
+    return fold
+
+
+# Embeds are built without their cache, as for a content never sent before
+def benchEmbedHeader(nbOfPlayers):
+    return lambda: buildEmbed.__wrapped__(getTemplate("Cartes jouées :", 'red').render("description"))
+
+
+def benchCallingSummary(nbOfPlayers):
+    view = getPlayingState(nbOfPlayers).view()
+    return lambda: buildEmbed.__wrapped__(initCallingSummary(view))
+
+
+def benchPlayingSummary(nbOfPlayers):
+    state = getPlayingState(nbOfPlayers)
+    for action in getFoldActions(state)[:-1]:
+        state, events = apply(state, action)
+    view = state.view()
+    return lambda: buildEmbed.__wrapped__(initPlayingSummary(view))
+
+
+def benchCalibration(nbOfPlayers):
+    return lambda: sum(range(1000))
+
+
+# name: (setup, True when it is run for every number of players)
+BENCHMARKS = {
+    'shuffle': (benchShuffle, False),
+    'deal': (benchDeal, True),
+    'hasCard': (benchHasCard, True),
+    'removeCard': (benchRemoveCard, False),
+    'fold': (benchFold, True),
+    'embedHeader': (benchEmbedHeader, False),
+    'callingSummary': (benchCallingSummary, True),
+    'playingSummary': (benchPlayingSummary, True),
+}
+
+
+# Time of one call in microseconds. Every benchmark is timed in several passes
+# spread over the run, each pass keeping its best repeat, and the median of the
+# passes is kept: a slow moment of the machine only moves one pass, and a
+# lucky one doesn't become the reference either.
+def runBenchmarks(selected=None):
+    timers = {CALIBRATION: timeit.Timer(benchCalibration(0))}
+    for name, (setup, byPlayers) in BENCHMARKS.items():
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        if byPlayers:
+            for nbOfPlayers in range(MIN_PLAYER, MAX_PLAYER + 1):
+                timers[name + '/' + str(nbOfPlayers)] = timeit.Timer(setup(nbOfPlayers))
+        else:
+            timers[name] = timeit.Timer(setup(MIN_PLAYER))
+    numbers = {name: max(1, timer.autorange()[0] // 4) for name, timer in timers.items()}
+    passes = {name: [] for name in timers}
+    for runPass in range(PASSES):
+        for name, timer in timers.items():
+            passes[name].append(min(timer.repeat(REPEAT, numbers[name])) / numbers[name] * 1e6)
+    return {name: statistics.median(times) for name, times in passes.items()}
+
+
+# Benchmarks slower than their baseline by more than threshold, once both runs
+# are scaled by their calibration time
+def compare(results, baselines, threshold=THRESHOLD):
+    regressions = []
+    scale = baselines[CALIBRATION] / results[CALIBRATION] if CALIBRATION in baselines else 1
+    for name, time in results.items():
+        baseline = baselines.get(name)
+        ratio = time * scale / baseline if baseline else None
+        status = ""
+        if ratio and ratio > 1 + threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        print("%-20s %10.2f us %10s %8s %s" % (name, time, "%.2f us" % baseline if baseline else "-",
+                                              "x%.2f" % ratio if ratio else "", status))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks des chemins chauds du jeu")
+    parser.add_argument('benchmarks', nargs='*', help="noms (ou morceaux de noms) des benchmarks à lancer")
+    parser.add_argument('--save', action='store_true', help="enregistre les résultats comme nouvelles références")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="ralentissement toléré (0.3 = +30%%)")
+    parser.add_argument('--baseline', default=BASELINE)
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.benchmarks)
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as file:
+            baselines = json.load(file)
+    regressions = compare(results, baselines, args.threshold)
+    if args.save:
+        # stored at the scale of the existing baselines, which keep their calibration
+        if CALIBRATION in baselines:
+            scale = baselines[CALIBRATION] / results.pop(CALIBRATION)
+            results = {name: time * scale for name, time in results.items()}
+        baselines.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print("références enregistrées dans " + args.baseline)
+    elif regressions:
+        print(str(len(regressions)) + " benchmark(s) plus lent(s) que la référence : " + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import asyncio
+import discord
+from dispatcher import dispatcher, channelRoute
+from render import buildEmbed
+
+# Updates received during this window are merged into a single edit
+COALESCE_DELAY = 0.5
+
+
+# Live status message of a table. update() only keeps the latest content and
+# schedules one edit, so a burst of calls/plays costs one API call. Contents
+# equal to what the message already shows are not sent again.
+class StatusBoard:
+    def __init__(self):
+        self.ctx = None
+        self.message = None
+        self.shown = None
+        self.pending = None
+        self.flushTask = None
+        self.lock = asyncio.Lock()
+
+    def update(self, ctx, content):
+        self.ctx = ctx
+        self.pending = content
+        if self.flushTask is None:
+            self.flushTask = asyncio.ensure_future(self.__flushLater())
+
+    async def __flushLater(self):
+        await asyncio.sleep(COALESCE_DELAY)
+        self.flushTask = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            content, self.pending = self.pending, None
+            if content is None or (self.message and content == self.shown):
+                return
+            embedMsg = buildEmbed(content)
+            route = channelRoute(self.ctx.message.channel)
+            self.shown = content
+            if self.message:
+                try:
+                    await dispatcher.call(route, self.message.edit, embed=embedMsg)
+                    return
+                except discord.NotFound:  # someone deleted the board
+                    pass
+            self.message = await dispatcher.call(route, self.ctx.send, embed=embedMsg)
+
+    # Sends what is pending right away and leaves the message as it is, the next
+    # update starts a new board message
+    async def detach(self):
+        if self.flushTask:
+            self.flushTask.cancel()
+            self.flushTask = None
+        await self.flush()
+        self.message = None
+        self.shown = None
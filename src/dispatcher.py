@@ -0,0 +1,118 @@
+import asyncio
+import time
+from metrics import metrics
+
+# Discord allows about 50 requests/s per bot and 5 messages per 5 s on a given
+# channel (a DM is a channel too)
+GLOBAL_RATE = 50
+GLOBAL_BURST = 50
+ROUTE_RATE = 1
+ROUTE_BURST = 5
+MAX_IN_FLIGHT = 16
+MAX_RETRIES = 3
+MAX_ROUTES = 4096
+
+
+def channelRoute(channel):
+    return "channel:" + str(channel.id)
+
+
+def dmRoute(user):
+    return "dm:" + str(user.id)
+
+
+# Seconds to wait if the error is a 429, None otherwise
+def getRetryAfter(error):
+    if getattr(error, 'status', None) != 429:
+        return None
+    retryAfter = getattr(error, 'retry_after', None)
+    if retryAfter is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        retryAfter = headers.get('Retry-After', 1)
+    return float(retryAfter)
+
+
+# send, dm, edit or delete
+def getApiKind(route, request):
+    kind = getattr(request, '__name__', 'request')
+    if kind == 'send' and route.startswith('dm:'):
+        return 'dm'
+    return kind
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Takes a token and returns how long the caller has to wait before using it
+    def reserve(self):
+        self.__refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def isFull(self):
+        self.__refill()
+        return self.tokens >= self.burst
+
+    def block(self, delay):
+        self.__refill()
+        self.tokens = min(self.tokens, -delay * self.rate)
+
+
+class Dispatcher:
+    def __init__(self, maxInFlight=MAX_IN_FLIGHT):
+        self.maxInFlight = maxInFlight
+        self.semaphore = None
+        self.globalBucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.routes = {}
+        # in a table worker the calls go to the bot, whose dispatcher limits,
+        # retries and counts them, see workers.py
+        self.forwarding = False
+
+    def __getBucket(self, route):
+        bucket = self.routes.get(route)
+        if bucket is None:
+            if len(self.routes) >= MAX_ROUTES:
+                self.routes = {key: value for key, value in self.routes.items() if not value.isFull()}
+            bucket = TokenBucket(ROUTE_RATE, ROUTE_BURST)
+            self.routes[route] = bucket
+        return bucket
+
+    async def call(self, route, request, *args, **kwargs):
+        if self.forwarding:
+            return await request(*args, **kwargs)
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.maxInFlight)
+        bucket = self.__getBucket(route)
+        kind = getApiKind(route, request)
+        for attempt in range(MAX_RETRIES + 1):
+            delay = max(self.globalBucket.reserve(), bucket.reserve())
+            if delay:
+                metrics.countRateLimitWait(delay)
+                await asyncio.sleep(delay)
+            async with self.semaphore:
+                try:
+                    metrics.countApiCall(kind)
+                    return await request(*args, **kwargs)
+                except Exception as error:
+                    retryAfter = getRetryAfter(error)
+                    if retryAfter is None or attempt == MAX_RETRIES:
+                        raise
+                    metrics.countRateLimitWait(retryAfter, rateLimited=True)
+                    if getattr(error, 'global', False):
+                        self.globalBucket.block(retryAfter)
+                    bucket.block(retryAfter)
+
+
+dispatcher = Dispatcher()
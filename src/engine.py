@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+
+# Rules of the game, without any discord dependency.
+# apply(state, action) never modifies the given state: it returns the new state
+# and the list of events the adapter (taraf.GameContext) has to render.
+
+from collections import namedtuple
+from enum import Enum
+from random import Random
+
+# MIN and MAX values are inclusive (>=, <=)
+MIN_PLAYER = 2
+MAX_PLAYER = 6
+NB_OF_CARDS = 22
+JOKER = 22
+CHEAT_ON = True
+DEBUG_ON = False
+
+
+# Debug print
+def dprint(string):
+    if DEBUG_ON:
+        print(string)
+
+
+# Cheat print
+def cprint(string):
+    if CHEAT_ON:
+        print(string)
+
+
+class TurnState(Enum):
+    WAITING = 1
+    CALLING = 2
+    PLAYING = 3
+    PLAYING_OVER = 4
+
+
+class EventType(Enum):
+    PLAYER_JOINED = 1
+    ALREADY_JOINED = 2
+    TABLE_FULL = 3
+    NOT_ENOUGH_PLAYERS = 4
+    PLAYERS_ORDERED = 5
+    NEW_TURN = 6
+    CALL_MADE = 7
+    CALL_REFUSED = 8
+    CALLING_OVER = 9
+    LAST_TURN = 10
+    CARD_PLAYED = 11
+    MISSING_CARD = 12
+    FOLD_WON = 13
+    NEW_FOLD = 14
+    TURN_SCORED = 15
+    DEALER_CHANGED = 16
+    GAME_OVER = 17
+
+
+# Actions
+class Join:
+    def __init__(self, name):
+        self.name = name
+
+
+class Go:
+    pass
+
+
+class Call:
+    def __init__(self, name, call):
+        self.name = name
+        self.call = call
+
+
+class Play:
+    def __init__(self, name, card):
+        self.name = name
+        self.card = card
+
+
+# Frozen copy of the table taken when an event is emitted
+PlayerView = namedtuple('PlayerView', ['name', 'call', 'foldTaken', 'shitPoints', 'cardPlayed'])
+TableView = namedtuple('TableView', ['turnState', 'players', 'currentPlayer', 'currentTurn',
+                                     'sumOfCalls', 'maxNbOfCalls', 'highestCard', 'highestCardOwner'])
+
+
+class Event:
+    def __init__(self, type, view, **data):
+        self.type = type
+        self.view = view
+        self.__dict__.update(data)
+
+
+# A hand is an int where bit n is set when the player holds card n
+def cardsOf(hand):
+    cards = []
+    while hand:
+        lowest = hand & -hand
+        cards.append(lowest.bit_length() - 1)
+        hand ^= lowest
+    return cards
+
+
+def firstCard(hand):
+    return (hand & -hand).bit_length() - 1
+
+
+def countCards(hand):
+    return bin(hand).count('1')
+
+
+class Player:
+    __slots__ = ('name', 'isMaster', 'hand', 'call', 'foldTaken', 'shitPoints', 'cardPlayed')
+
+    def __init__(self, name, isMaster):
+        self.name = name
+        self.isMaster = bool(isMaster)
+        self.hand = 0
+        self.call = 0
+        self.foldTaken = 0
+        self.shitPoints = 0
+        self.cardPlayed = "NA"
+
+    @property
+    def cards(self):
+        return cardsOf(self.hand)
+
+    def hasCard(self, card):
+        return 0 < card <= JOKER and self.hand >> card & 1 == 1
+
+    def removeCard(self, card):
+        self.hand &= ~(1 << card)
+
+    def copy(self):
+        player = Player.__new__(Player)
+        for slot in Player.__slots__:
+            setattr(player, slot, getattr(self, slot))
+        return player
+
+
+def getActualCard(card):
+    if card == 0:
+        return JOKER
+    else:
+        return card
+
+
+class Deck:
+    def __init__(self):
+        self.cards = []
+
+    def shuffle(self, nbOfCards, rng):
+        self.cards = list(range(1, nbOfCards + 1))
+        rng.shuffle(self.cards)
+
+
+class TableState:
+    def __init__(self, seed=None):
+        # Recurent infos
+        self.turnState = TurnState.WAITING
+        # Seats never move once the game started, dealer is the seat of the
+        # current dealer and positions are counted from it
+        self.seats = []
+        self.seatIndex = {}
+        self.dealer = 0
+        self.deck = Deck()
+        self.rng = Random(seed)
+        self.rngShared = False
+        self.nbOfTurns = 0
+        self.currentTurn = 0
+        self.currentPlayer = 0
+        self.firstPlayer = 0
+        self.firstDealer = None
+        # DealerTurn based infos
+        self.sumOfCalls = 0
+        self.maxNbOfCalls = 99
+        # Fold based infos
+        self.highestCard = 0
+        self.highestCardOwner = None
+
+    def copy(self):
+        state = TableState.__new__(TableState)
+        state.__dict__.update(self.__dict__)
+        state.seats = [player.copy() for player in self.seats]
+        state.seatIndex = dict(self.seatIndex)
+        state.deck = Deck()
+        state.deck.cards = list(self.deck.cards)
+        # the rng is shared until an action draws from it, see getRng
+        self.rngShared = state.rngShared = True
+        return state
+
+    # Copying the rng state costs more than the rest of the table, only Go and
+    # the deals pay for it
+    def getRng(self):
+        if self.rngShared:
+            rng = Random.__new__(Random)  # Random() would seed itself from os.urandom first
+            rng.setstate(self.rng.getstate())
+            self.rng = rng
+            self.rngShared = False
+        return self.rng
+
+    # Plain data for snapshots (journal.py), the rng state included so a
+    # restored table deals the same cards
+    def toDict(self):
+        data = dict(self.__dict__)
+        data['turnState'] = self.turnState.name
+        data['seats'] = [[getattr(player, slot) for slot in Player.__slots__] for player in self.seats]
+        data['deck'] = self.deck.cards
+        data['rng'] = self.rng.getstate()
+        del data['rngShared']
+        return data
+
+    @staticmethod
+    def fromDict(data):
+        state = TableState()
+        state.__dict__.update(data)
+        state.turnState = TurnState[data['turnState']]
+        state.seats = []
+        for values in data['seats']:
+            player = Player.__new__(Player)
+            for slot, value in zip(Player.__slots__, values):
+                setattr(player, slot, value)
+            state.seats.append(player)
+        state.deck = Deck()
+        state.deck.cards = list(data['deck'])
+        version, internalState, gauss = data['rng']
+        state.rng = Random()
+        state.rng.setstate((version, tuple(internalState), gauss))
+        return state
+
+    @property
+    def players(self):
+        return self.seats[self.dealer:] + self.seats[:self.dealer]
+
+    def seatAt(self, position):
+        return self.seats[(self.dealer + position) % len(self.seats)]
+
+    def view(self):
+        current = self.seatAt(self.currentPlayer).name if self.currentPlayer < len(self.seats) else None
+        return TableView(self.turnState,
+                         tuple(PlayerView(player.name, player.call, player.foldTaken, player.shitPoints,
+                                          player.cardPlayed) for player in self.players),
+                         current, self.currentTurn, self.sumOfCalls, self.maxNbOfCalls,
+                         self.highestCard, self.highestCardOwner)
+
+    def getPlayerByName(self, name):
+        index = self.seatIndex.get(name)
+        if index is not None:
+            return self.seats[index]
+
+    def getPlayerPosition(self, name):
+        index = self.seatIndex.get(name)
+        if index is None:
+            return 99
+        return (index - self.dealer) % len(self.seats)
+
+    def isThisPlayerTurnToPlay(self, name):
+        return self.getPlayerPosition(name) == self.currentPlayer
+
+    def isThisPlayerMaster(self, name):
+        player = self.getPlayerByName(name)
+        if player:
+            return player.isMaster
+        else:
+            return False
+
+    def getPlayerList(self):
+        return [player.name for player in self.players]
+
+    def doesHeHaveThatCard(self, playerName, card):
+        return self.getPlayerByName(playerName).hasCard(int(getActualCard(card)))
+
+
+def apply(state, action):
+    state = state.copy()
+    events = []
+    HANDLERS[type(action)](state, action, events)
+    return state, events
+
+
+def emit(state, events, type, **data):
+    events.append(Event(type, state.view(), **data))
+
+
+def handleJoin(state, action, events):
+    if state.getPlayerByName(action.name):
+        emit(state, events, EventType.ALREADY_JOINED, name=action.name)
+    elif len(state.seats) <= MAX_PLAYER:
+        state.seatIndex[action.name] = len(state.seats)
+        state.seats.append(Player(action.name, not state.seats))
+        emit(state, events, EventType.PLAYER_JOINED, name=action.name)
+    else:
+        emit(state, events, EventType.TABLE_FULL)
+
+
+def handleGo(state, action, events):
+    if state.turnState != TurnState.WAITING:
+        return
+    if len(state.seats) < MIN_PLAYER:
+        emit(state, events, EventType.NOT_ENOUGH_PLAYERS)
+        return
+    state.nbOfTurns = NB_OF_CARDS // len(state.seats)
+    rearmCurrentTurn(state)
+    state.getRng().shuffle(state.seats)
+    state.seatIndex = {player.name: index for index, player in enumerate(state.seats)}
+    emit(state, events, EventType.PLAYERS_ORDERED)
+    state.currentPlayer = 0
+    state.firstPlayer = 0
+    state.firstDealer = state.seatAt(0).name
+    startNewTurn(state, events)
+
+
+def handleCall(state, action, events):
+    if state.turnState == TurnState.CALLING and state.isThisPlayerTurnToPlay(action.name):
+        call = int(action.call)
+        if not 0 <= call <= state.maxNbOfCalls or (state.currentPlayer == len(state.seats) - 1
+                                                   and state.sumOfCalls + call == state.maxNbOfCalls):
+            emit(state, events, EventType.CALL_REFUSED, name=action.name, call=action.call)
+        else:
+            state.getPlayerByName(action.name).call = call
+            state.sumOfCalls += call
+            state.currentPlayer += 1
+            emit(state, events, EventType.CALL_MADE, name=action.name, call=action.call)
+            if state.currentPlayer == len(state.seats):
+                startPlayingPhase(state)
+                emit(state, events, EventType.CALLING_OVER)
+                if state.currentTurn == 0:  # plays cards automatically on last turn since player don't know their cards
+                    handleLastTurn(state, events)
+
+
+def handlePlay(state, action, events):
+    if state.turnState == TurnState.PLAYING and state.isThisPlayerTurnToPlay(action.name):
+        if state.doesHeHaveThatCard(action.name, action.card):
+            player = state.getPlayerByName(action.name)
+            player.removeCard(int(getActualCard(action.card)))
+            player.cardPlayed = str(action.card)
+            checkIfCardIsHigher(state, action.card, action.name)
+            incrementCurrentPlayer(state)
+            foldOver = state.currentPlayer == state.firstPlayer
+            emit(state, events, EventType.CARD_PLAYED, name=action.name, card=action.card, foldOver=foldOver)
+            if foldOver:
+                endFold(state, events)
+        else:
+            emit(state, events, EventType.MISSING_CARD, name=action.name)
+
+
+HANDLERS = {
+    Join: handleJoin,
+    Go: handleGo,
+    Call: handleCall,
+    Play: handlePlay,
+}
+
+
+def rearmCurrentTurn(state):
+    if DEBUG_ON:
+        state.currentTurn = 1
+    else:
+        state.currentTurn = state.nbOfTurns
+
+
+def dealCards(state):
+    if state.currentTurn == 0:
+        nbOfCards = 1  # Deal 1 card for turn 0 (last turn)
+        state.deck.shuffle(NB_OF_CARDS - 1, state.getRng())  # No joker (22) on last turn
+    else:
+        nbOfCards = state.currentTurn
+        state.deck.shuffle(NB_OF_CARDS, state.getRng())
+    dprint("Cards shuffled")
+    dprint(state.deck.cards)
+    players = state.players
+    for cardsToDeal in range(nbOfCards):
+        for player in players:
+            player.hand |= 1 << state.deck.cards.pop()
+
+
+def startCallingPhase(state):
+    dprint("Starting calling phase")
+    state.turnState = TurnState.CALLING
+    state.sumOfCalls = 0
+    state.firstPlayer = 0
+    state.currentPlayer = state.firstPlayer
+    if state.currentTurn == 0:
+        state.maxNbOfCalls = 1
+    else:
+        state.maxNbOfCalls = state.currentTurn
+    # Reseting fold taken
+    for player in state.seats:
+        player.foldTaken = 0
+        player.call = "NA"
+
+
+def startPlayingPhase(state):
+    dprint("Starting playing phase")
+    state.turnState = TurnState.PLAYING
+    state.firstPlayer = 0
+    state.currentPlayer = state.firstPlayer
+    state.highestCard = 0
+    state.highestCardOwner = None
+
+
+def startNewTurn(state, events):
+    dealCards(state)
+    startCallingPhase(state)
+    emit(state, events, EventType.NEW_TURN)
+
+
+# The blind last turn is a single forced fold: every card is played, the fold
+# and the shit points are counted at once and one LAST_TURN event shows it all
+def handleLastTurn(state, events):
+    for player in state.players:
+        card = firstCard(player.hand)
+        player.removeCard(card)
+        player.cardPlayed = str(card)
+        checkIfCardIsHigher(state, card, player.name)
+    state.getPlayerByName(state.highestCardOwner).foldTaken += 1
+    scoreTurn(state)
+    emit(state, events, EventType.LAST_TURN, name=state.highestCardOwner)
+    state.highestCard = 0
+    for player in state.seats:
+        player.cardPlayed = "NA"
+    state.currentTurn -= 1
+    nextDealer(state, events)
+
+
+def incrementCurrentPlayer(state):
+    state.currentPlayer += 1
+    if state.currentPlayer == len(state.seats):
+        state.currentPlayer = 0
+
+
+def checkIfCardIsHigher(state, card, playerName):
+    if int(card) > state.highestCard:
+        state.highestCard = int(card)
+        state.highestCardOwner = playerName
+
+
+def endFold(state, events):
+    state.getPlayerByName(state.highestCardOwner).foldTaken += 1
+    emit(state, events, EventType.FOLD_WON, name=state.highestCardOwner)
+    state.highestCard = 0
+    if state.seatAt(state.currentPlayer).hand:  # New fold
+        state.firstPlayer = state.getPlayerPosition(state.highestCardOwner)
+        state.currentPlayer = state.firstPlayer
+        for player in state.seats:
+            player.cardPlayed = "NA"
+        emit(state, events, EventType.NEW_FOLD)
+    else:  # Turn is over
+        computeShitPoints(state, events)
+        for player in state.seats:
+            player.cardPlayed = "NA"
+        state.currentTurn -= 1
+        if state.currentTurn >= 0:
+            startNewTurn(state, events)
+        else:
+            nextDealer(state, events)
+
+
+def scoreTurn(state):
+    for player in state.seats:
+        if player.call != player.foldTaken:
+            player.shitPoints += abs(player.call - player.foldTaken)
+
+
+def computeShitPoints(state, events):
+    scoreTurn(state)
+    emit(state, events, EventType.TURN_SCORED)
+
+
+def nextDealer(state, events):
+    if state.seatAt(1).name == state.firstDealer:
+        state.turnState = TurnState.PLAYING_OVER
+        emit(state, events, EventType.GAME_OVER)
+    else:
+        state.dealer = (state.dealer + 1) % len(state.seats)  # Current dealer is at position 0
+        emit(state, events, EventType.DEALER_CHANGED, name=state.seatAt(0).name)
+        rearmCurrentTurn(state)
+        startNewTurn(state, events)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# Connection between the gateway process and a table worker: JSON lines over a
+# unix socket. Both sides send requests, answered by a reply with the same id,
+# and notifications, which aren't answered. Received messages are handled in
+# the order they arrive, each one in its own task.
+
+import asyncio
+import itertools
+import json
+
+MAX_LINE = 2 ** 22
+
+
+# An error raised on the other side; status is the HTTP status of a discord error
+class RemoteError(Exception):
+    def __init__(self, error):
+        super().__init__(error.get('text'))
+        self.status = error.get('status')
+
+
+class Connection:
+    # handler(message) is a coroutine called with every request or notification
+    # received, what it returns is sent back as the reply of a request
+    def __init__(self, reader, writer, handler):
+        self.reader = reader
+        self.writer = writer
+        self.handler = handler
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.task = asyncio.ensure_future(self.__run())
+
+    def __send(self, message):
+        self.writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+
+    async def request(self, message):
+        message['id'] = next(self.ids)
+        future = asyncio.get_event_loop().create_future()
+        self.pending[message['id']] = future
+        try:
+            self.__send(message)
+            await self.writer.drain()
+            return await future
+        finally:
+            self.pending.pop(message['id'], None)
+
+    def notify(self, message):
+        self.__send(message)
+
+    def close(self):
+        self.writer.close()
+
+    async def __run(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    return
+                message = json.loads(line)
+                if 're' in message:
+                    future = self.pending.get(message['re'])
+                    if future and not future.done():
+                        if 'error' in message:
+                            future.set_exception(RemoteError(message['error']))
+                        else:
+                            future.set_result(message.get('result'))
+                else:
+                    asyncio.ensure_future(self.__handle(message))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connexion fermée"))
+            self.writer.close()
+
+    async def __handle(self, message):
+        try:
+            result = await self.handler(message)
+        except Exception as error:
+            if 'id' not in message:
+                print("Erreur sur " + str(message.get('op')) + " : " + repr(error))
+                return
+            reply = {'re': message['id'], 'error': {'status': getattr(error, 'status', None), 'text': repr(error)}}
+        else:
+            if 'id' not in message:
+                return
+            reply = {'re': message['id'], 'result': result}
+        if not self.writer.is_closing():
+            self.__send(reply)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+# Append-only journal of each table, so open tables can be rebuilt after a restart.
+# One JSON record per line: table transitions (open with the shuffle seed,
+# sign-in) and engine actions with the names of the events they produced.
+# Records are written and fsynced in batches every SYNC_DELAY. Every
+# SNAPSHOT_EVERY records the whole table is written to a snapshot and the
+# journal is truncated, so a replay never reads more than SNAPSHOT_EVERY records.
+# Finished games are kept whole in the archive, see replay.py.
+
+import json
+import os
+import time
+from batch import BatchWriter
+from engine import Join, Go, Call, Play
+
+JOURNAL_DIR = 'journals'
+ARCHIVE_DIR = 'archives'
+SYNC_DELAY = 0.05
+SNAPSHOT_EVERY = 200
+
+ACTIONS = {
+    'join': Join,
+    'go': Go,
+    'call': Call,
+    'play': Play,
+}
+RECORD_TYPES = {action: name for name, action in ACTIONS.items()}
+
+def getFileName(key):
+    guild, channel = key
+    return str(guild) + '_' + str(channel)
+
+
+def getKey(fileName):
+    guild, channel = fileName.split('_')
+    return None if guild == 'None' else int(guild), int(channel)
+
+
+def toRecord(action, events, **extra):
+    record = {'t': RECORD_TYPES[type(action)]}
+    record.update(vars(action))
+    record.update(extra)
+    if events:
+        record['ev'] = [event.type.name for event in events]
+    return record
+
+
+def toAction(record):
+    action = ACTIONS[record['t']].__new__(ACTIONS[record['t']])
+    for field, value in record.items():
+        if field not in ('t', 'n', 'ev', 'user', 'bot'):
+            setattr(action, field, value)
+    return action
+
+
+class Journal:
+    def __init__(self, key, directory=JOURNAL_DIR):
+        self.key = key
+        self.path = os.path.join(directory, getFileName(key) + '.log')
+        self.snapshotPath = os.path.join(directory, getFileName(key) + '.snap')
+        self.seq = 0
+        self.sinceSnapshot = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, record):
+        self.seq += 1
+        self.sinceSnapshot += 1
+        record['n'] = self.seq
+        journalWriter.append((self, ('record', json.dumps(record, ensure_ascii=False, separators=(',', ':')))))
+
+    async def flush(self):
+        await journalWriter.flush()
+
+    def shouldSnapshot(self):
+        return self.sinceSnapshot >= SNAPSHOT_EVERY
+
+    # The snapshot replaces the journal: records up to seq are dropped, and a
+    # crash between the two writes only leaves records the replay skips. It is
+    # serialized right away, the table goes on while it is written.
+    def snapshot(self, data):
+        self.sinceSnapshot = 0
+        journalWriter.append((self, ('snapshot', json.dumps({'n': self.seq, 'table': data}, ensure_ascii=False,
+                                                            separators=(',', ':')))))
+
+    # Runs in the io thread, in the order the records and snapshots were made
+    def write(self, operations):
+        lines = []
+        for operation, data in operations:
+            if operation == 'record':
+                lines.append(data)
+                continue
+            self.__writeLines(lines)
+            lines = []
+            if operation == 'snapshot':
+                self.__writeSnapshot(data)
+            else:
+                self.__remove()
+        self.__writeLines(lines)
+
+    def __writeLines(self, lines):
+        if lines:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write('\n'.join(lines) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+
+    def __writeSnapshot(self, data):
+        temporaryPath = self.snapshotPath + '.tmp'
+        with open(temporaryPath, 'w', encoding='utf-8') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporaryPath, self.snapshotPath)
+        with open(self.path, 'w', encoding='utf-8') as file:
+            os.fsync(file.fileno())
+
+    # Snapshot (or None) and the records written after it
+    def load(self):
+        snapshot = None
+        if os.path.exists(self.snapshotPath):
+            with open(self.snapshotPath, encoding='utf-8') as file:
+                snapshot = json.load(file)
+            self.seq = snapshot['n']
+        records = []
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as file:
+                data = file.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):  # last line cut by a crash, the next records must start on a new line
+                    file.truncate(end)
+            for line in data[:end].splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:  # cut by a crash, the lines after it are good
+                    continue
+                if record['n'] > self.seq:
+                    records.append(record)
+                    self.seq = record['n']
+        self.sinceSnapshot = len(records)
+        return (snapshot['table'] if snapshot else None), records
+
+    async def close(self, remove=False):
+        if remove:
+            journalWriter.append((self, ('remove', None)))
+        await self.flush()
+
+    def __remove(self):
+        for path in (self.path, self.snapshotPath):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# Every journal goes through one writer: every SYNC_DELAY, a single batch writes
+# what all the tables journaled, each file being fsynced once. Operations are
+# grouped by file, so a table closed and opened again keeps its order.
+def writeJournals(operations):
+    byPath = {}
+    for journal, operation in operations:
+        byPath.setdefault(journal.path, (journal, []))[1].append(operation)
+    for journal, fileOperations in byPath.values():
+        try:
+            journal.write(fileOperations)
+        except OSError as error:  # the other tables are still written
+            print("Journal " + journal.path + " non écrit : " + repr(error))
+
+
+journalWriter = BatchWriter(writeJournals, SYNC_DELAY)
+
+
+def listJournals(directory=JOURNAL_DIR):
+    if not os.path.isdir(directory):
+        return []
+    names = {fileName.rsplit('.', 1)[0] for fileName in os.listdir(directory)
+             if fileName.endswith('.log') or fileName.endswith('.snap')}
+    return [getKey(name) for name in sorted(names)]
+
+
+# One JSON line per finished game: its seed and all its records. Every process
+# writes its own file of the day (the table workers too).
+class Archive:
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.writer = BatchWriter(self.__write, SYNC_DELAY)
+
+    def getPath(self):
+        return os.path.join(self.directory, 'games-' + time.strftime('%Y%m%d') + '-' + str(os.getpid()) + '.jsonl')
+
+    def append(self, game):
+        self.writer.append(json.dumps(game, ensure_ascii=False, separators=(',', ':')))
+
+    async def flush(self):
+        await self.writer.flush()
+
+    def __write(self, lines):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.getPath(), 'a', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+
+
+# Archive files found in paths (files or directories)
+def listArchives(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, fileName) for fileName in os.listdir(path) if fileName.endswith('.jsonl'))
+        else:
+            files.append(path)
+    return files
+
+
+# (line number, game) of each game of an archive file
+def readArchive(path):
+    with open(path, encoding='utf-8') as file:
+        for number, line in enumerate(file, 1):
+            try:
+                yield number, json.loads(line)
+            except ValueError:  # cut by a crash
+                continue
+
+
+archive = Archive()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Results of finished games, kept in SQLite. playerStats holds the aggregates of
+# each player of a guild and is updated with every result, so !leaderboard and
+# !stats read a few precomputed rows instead of the whole history.
+# Results are written in batches by the io thread, off the event loop.
+
+import sqlite3
+import time
+from collections import namedtuple
+from batch import BatchWriter, runInIoThread
+
+DATABASE = 'taraf.db'
+WRITE_DELAY = 1.0
+LEADERBOARD_SIZE = 10
+
+Result = namedtuple('Result', ['name', 'shitPoints', 'won'])
+PlayerStats = namedtuple('PlayerStats', ['player', 'games', 'wins', 'totalShitPoints', 'averageShitPoints',
+                                         'bestShitPoints', 'lastPlayed'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    guild INTEGER NOT NULL,
+    channel INTEGER NOT NULL,
+    endedAt REAL NOT NULL,
+    nbOfPlayers INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    game INTEGER NOT NULL REFERENCES games(id),
+    guild INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    shitPoints INTEGER NOT NULL,
+    won INTEGER NOT NULL,
+    endedAt REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playerStats (
+    guild INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    totalShitPoints INTEGER NOT NULL,
+    averageShitPoints REAL NOT NULL,
+    bestShitPoints INTEGER NOT NULL,
+    lastPlayed REAL NOT NULL,
+    PRIMARY KEY (guild, player)
+);
+CREATE INDEX IF NOT EXISTS gamesByGuild ON games (guild, endedAt);
+CREATE INDEX IF NOT EXISTS resultsByPlayer ON results (guild, player, endedAt);
+CREATE INDEX IF NOT EXISTS resultsByDate ON results (endedAt);
+CREATE INDEX IF NOT EXISTS ranking ON playerStats (guild, wins DESC, averageShitPoints);
+"""
+
+UPDATE_STATS = """
+INSERT INTO playerStats (guild, player, games, wins, totalShitPoints, averageShitPoints, bestShitPoints, lastPlayed)
+VALUES (:guild, :player, 1, :won, :shitPoints, :shitPoints, :shitPoints, :endedAt)
+ON CONFLICT (guild, player) DO UPDATE SET
+    games = games + 1,
+    wins = wins + excluded.wins,
+    totalShitPoints = totalShitPoints + excluded.totalShitPoints,
+    averageShitPoints = CAST(totalShitPoints + excluded.totalShitPoints AS REAL) / (games + 1),
+    bestShitPoints = MIN(bestShitPoints, excluded.bestShitPoints),
+    lastPlayed = MAX(lastPlayed, excluded.lastPlayed)
+"""
+
+
+# Every player with the lowest shit points wins
+def getResults(view, bots=()):
+    best = min(player.shitPoints for player in view.players)
+    return [Result(player.name, player.shitPoints, player.shitPoints == best)
+            for player in view.players if player.name not in bots]
+
+
+class Leaderboard:
+    def __init__(self, path=DATABASE):
+        self.path = path
+        self.connection = None  # only used in the io thread, see batch.py
+        self.writer = BatchWriter(self.__write, WRITE_DELAY)
+
+    def __connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode=WAL")  # the table workers write while the bot reads
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    # guild is None for games played in DMs
+    def record(self, guild, channel, results, nbOfPlayers):
+        if results:
+            self.writer.append((guild or 0, channel, time.time(), nbOfPlayers, results))
+
+    async def flush(self):
+        await self.writer.flush()
+
+    def __write(self, games):
+        connection = self.__connect()
+        with connection:  # one transaction per batch
+            for guild, channel, endedAt, nbOfPlayers, results in games:
+                game = connection.execute("INSERT INTO games (guild, channel, endedAt, nbOfPlayers) VALUES (?, ?, ?, ?)",
+                                          (guild, channel, endedAt, nbOfPlayers)).lastrowid
+                rows = [{'game': game, 'guild': guild, 'player': result.name, 'shitPoints': result.shitPoints,
+                         'won': int(result.won), 'endedAt': endedAt} for result in results]
+                connection.executemany("INSERT INTO results (game, guild, player, shitPoints, won, endedAt) "
+                                       "VALUES (:game, :guild, :player, :shitPoints, :won, :endedAt)", rows)
+                connection.executemany(UPDATE_STATS, rows)
+
+    def __readLeaderboard(self, guild, size):
+        rows = self.__connect().execute(
+            "SELECT player, games, wins, totalShitPoints, averageShitPoints, bestShitPoints, lastPlayed "
+            "FROM playerStats WHERE guild = ? ORDER BY wins DESC, averageShitPoints LIMIT ?", (guild, size))
+        return [PlayerStats(*row) for row in rows]
+
+    def __readStats(self, guild, player):
+        row = self.__connect().execute(
+            "SELECT player, games, wins, totalShitPoints, averageShitPoints, bestShitPoints, lastPlayed "
+            "FROM playerStats WHERE guild = ? AND player = ?", (guild, player)).fetchone()
+        return PlayerStats(*row) if row else None
+
+    async def getLeaderboard(self, guild, size=LEADERBOARD_SIZE):
+        await self.flush()
+        return await runInIoThread(self.__readLeaderboard, guild or 0, size)
+
+    async def getStats(self, guild, player):
+        await self.flush()
+        return await runInIoThread(self.__readStats, guild or 0, player)
+
+
+leaderboard = Leaderboard()
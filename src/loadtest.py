@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+# Offline load test: TarCog runs against a fake of the discord.py surface it
+# uses (ctx.send, ctx.message.delete, user.send, Message.edit/delete), with a
+# configurable latency and a share of requests answered by a 429. Scripted
+# players play whole games on many tables at once.
+#
+# python loadtest.py --tables 500 --players 4 --latency 0.05 --rate-limited 0.01
+#
+# By default the bot side rate limits of dispatcher.py are lifted so the run
+# measures our own overhead; --discord-limits keeps them. --journal writes the
+# journals, the archive and the column files (in a temporary directory) like
+# the bot does.
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+import board
+import dispatcher
+import leaderboard
+from analytics import STATS_DIR, columnWriter
+from journal import ARCHIVE_DIR, JOURNAL_DIR, archive, journalWriter
+from tables import TableRegistry
+from tarcog import TarCog
+from advisor import getAllowedCalls, choosePlay
+from engine import TurnState, JOKER
+
+UNLIMITED = 1e9
+
+ids = itertools.count(1)
+
+
+class RateLimited(Exception):
+    def __init__(self, retryAfter):
+        super().__init__("429 Too Many Requests")
+        self.status = 429
+        self.retry_after = retryAfter
+
+
+# Latency and 429s of the fake discord API, and the number of requests of each kind
+class FakeApi:
+    def __init__(self, latency=0.0, rateLimited=0.0, retryAfter=0.1, seed=None):
+        self.latency = latency
+        self.rateLimited = rateLimited
+        self.retryAfter = retryAfter
+        self.rng = random.Random(seed)
+        self.requests = Counter()
+
+    async def request(self, kind):
+        self.requests[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.rng.expovariate(1 / self.latency))
+        if self.rng.random() < self.rateLimited:
+            self.requests['429'] += 1
+            raise RateLimited(self.retryAfter)
+
+
+class FakeMessage:
+    def __init__(self, api, channel, author=None, embed=None):
+        self.api = api
+        self.id = next(ids)
+        self.channel = channel
+        self.author = author
+        self.embed = embed
+
+    async def edit(self, embed=None, **kwargs):
+        await self.api.request('edit')
+        self.embed = embed
+
+    async def delete(self):
+        await self.api.request('delete')
+
+
+class FakeChannel:
+    def __init__(self, api, name):
+        self.api = api
+        self.id = next(ids)
+        self.name = name
+
+    async def send(self, content=None, embed=None):
+        await self.api.request('send')
+        return FakeMessage(self.api, self, embed=embed)
+
+
+class FakeUser:
+    def __init__(self, api, name):
+        self.api = api
+        self.id = next(ids)
+        self.name = name
+        self.bot = False
+        self.dm = FakeChannel(api, name)
+
+    async def send(self, content=None, embed=None):
+        await self.api.request('dm')
+        return FakeMessage(self.api, self.dm, embed=embed)
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next(ids)
+
+
+class FakeContext:
+    def __init__(self, api, guild, channel, author):
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.message = FakeMessage(api, channel, author)
+
+    async def send(self, content=None, embed=None):
+        return await self.channel.send(content, embed=embed)
+
+
+# Drives one table from !start to the end of the game
+class ScriptedTable:
+    def __init__(self, cog, api, guild, number, nbOfPlayers, rng, latencies):
+        self.cog = cog
+        self.api = api
+        self.guild = guild
+        self.channel = FakeChannel(api, "table-" + str(number))
+        self.users = {user.name: user for user in [FakeUser(api, "joueur-" + str(number) + "-" + str(seat))
+                                                   for seat in range(nbOfPlayers)]}
+        self.rng = rng
+        self.latencies = latencies
+
+    async def command(self, command, user, *args):
+        start = time.perf_counter()
+        await command.callback(self.cog, FakeContext(self.api, self.guild, self.channel, user), *args)
+        self.latencies.append(time.perf_counter() - start)
+
+    async def play(self):
+        master = next(iter(self.users.values()))
+        await self.command(self.cog.start, master)
+        for user in self.users.values():
+            await self.command(self.cog.join, user)
+        await self.command(self.cog.go, master)
+        table = self.cog.tables.get(FakeContext(self.api, self.guild, self.channel, master))
+        while table.theGame.state.turnState in (TurnState.CALLING, TurnState.PLAYING):
+            state = table.theGame.state
+            name = state.seatAt(state.currentPlayer).name
+            if state.turnState == TurnState.CALLING:
+                await self.command(self.cog.call, self.users[name], str(self.rng.choice(getAllowedCalls(state, name))))
+            else:
+                card = choosePlay(state, name).card
+                await self.command(self.cog.play, self.users[name], {0: "J-", JOKER: "J+"}.get(card, str(card)))
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+# directory keeps the journals, the archive and the column files like in
+# production, None keeps the tables in memory only
+async def runLoadTest(nbOfTables, nbOfPlayers, api, seed=None, discordLimits=False, maxInFlight=None, directory=None):
+    if maxInFlight:
+        dispatcher.dispatcher.maxInFlight = maxInFlight
+    if not discordLimits:
+        dispatcher.dispatcher.globalBucket = dispatcher.TokenBucket(UNLIMITED, UNLIMITED)
+        dispatcher.ROUTE_RATE = dispatcher.ROUTE_BURST = UNLIMITED
+    leaderboard.leaderboard.path = ':memory:'
+    cog = TarCog(None)
+    cog.tables = TableRegistry(os.path.join(directory, JOURNAL_DIR) if directory else None)
+    if directory:
+        archive.directory = os.path.join(directory, ARCHIVE_DIR)
+        columnWriter.directory = os.path.join(directory, STATS_DIR)
+    guild = FakeGuild()
+    rng = random.Random(seed)
+    latencies = []
+    tables = [ScriptedTable(cog, api, guild, number, nbOfPlayers, random.Random(rng.random()), latencies)
+              for number in range(nbOfTables)]
+    start = time.perf_counter()
+    await asyncio.gather(*[table.play() for table in tables])
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(board.COALESCE_DELAY + 0.1)  # last board edits
+    await asyncio.gather(journalWriter.flush(), archive.flush(), columnWriter.flush(), leaderboard.leaderboard.flush())
+    latencies.sort()
+    return {
+        'commands': len(latencies),
+        'elapsed': elapsed,
+        'commandsPerSecond': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'requestsPerGame': {kind: count / nbOfTables for kind, count in api.requests.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge hors ligne de TarCog")
+    parser.add_argument('--tables', type=int, default=100)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0, help="latence moyenne de l'API (s)")
+    parser.add_argument('--rate-limited', type=float, default=0.0, help="part des requêtes refusées par un 429")
+    parser.add_argument('--retry-after', type=float, default=0.1)
+    parser.add_argument('--discord-limits', action='store_true', help="garde les limites de dispatcher.py")
+    parser.add_argument('--max-in-flight', type=int, default=None, help="requêtes simultanées (dispatcher.py)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--journal', action='store_true',
+                        help="écrit les journaux, l'archive et les statistiques comme en production")
+    args = parser.parse_args()
+
+    api = FakeApi(args.latency, args.rate_limited, args.retry_after, args.seed)
+    directory = tempfile.mkdtemp(prefix='taraf-loadtest-') if args.journal else None
+    try:
+        result = asyncio.run(runLoadTest(args.tables, args.players, api, args.seed, args.discord_limits,
+                                         args.max_in_flight, directory))
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+    print(str(args.tables) + " tables, " + str(args.tables * args.players) + " joueurs, " + str(result['commands'])
+          + " commandes en " + "%.1f" % result['elapsed'] + " s (" + "%.0f" % result['commandsPerSecond'] + " commandes/s)")
+    print("latence p50 " + "%.1f" % (1000 * result['p50']) + " ms, p99 " + "%.1f" % (1000 * result['p99']) + " ms")
+    print("appels API par partie : " + ', '.join(kind + " " + "%.1f" % count
+                                                 for kind, count in sorted(result['requestsPerGame'].items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# Metrics of the bot: command latency histograms, discord API calls, rate limit
+# waits, active tables and event loop lag. They are served in the Prometheus
+# text format on localhost (METRICS_PORT, 0 to disable) and summed up by !perf.
+# The sampling profiler is off until !perf profile turns it on.
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = int(os.getenv('TARAF_METRICS_PORT', '9108'))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_INTERVAL = 0.5
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP = 10
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    # Upper bound of the bucket holding the given share of the values
+    def quantile(self, share):
+        target = share * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if count and seen >= target:
+                return bound
+        return 0.0
+
+
+# Samples the stack of the event loop thread from another thread and counts the
+# functions found in it, inclusive (anywhere in the stack) and self (on top)
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.thread = None
+        self.running = False
+        self.targetId = None
+        self.samples = 0
+        self.inclusive = Counter()
+        self.exclusive = Counter()
+
+    def start(self):
+        if self.running:
+            return
+        self.targetId = threading.get_ident()
+        self.samples = 0
+        self.inclusive.clear()
+        self.exclusive.clear()
+        self.running = True
+        self.thread = threading.Thread(target=self.__sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def __sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.targetId)
+            if frame is not None:
+                self.samples += 1
+                self.exclusive[getFunctionName(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    name = getFunctionName(frame)
+                    if name not in seen:
+                        seen.add(name)
+                        self.inclusive[name] += 1
+                    frame = frame.f_back
+            time.sleep(self.interval)
+
+    def report(self, top=PROFILE_TOP):
+        return self.samples, self.inclusive.most_common(top), self.exclusive.most_common(top)
+
+
+def getFunctionName(frame):
+    code = frame.f_code
+    return os.path.basename(code.co_filename) + ':' + code.co_name
+
+
+class Metrics:
+    def __init__(self):
+        self.latencies = {}
+        self.apiCalls = Counter()
+        self.rateLimited = 0
+        self.rateLimitWaits = 0
+        self.rateLimitWaitTime = 0.0
+        self.loopLag = Histogram()
+        self.maxLoopLag = 0.0
+        self.gauges = {}
+        self.profiler = SamplingProfiler()
+        self.started = time.time()
+        self.server = None
+        self.lagTask = None
+
+    def observeCommand(self, command, elapsed):
+        histogram = self.latencies.get(command)
+        if histogram is None:
+            histogram = self.latencies[command] = Histogram()
+        histogram.observe(elapsed)
+
+    def countApiCall(self, kind):
+        self.apiCalls[kind] += 1
+
+    def countRateLimitWait(self, delay, rateLimited=False):
+        self.rateLimitWaits += 1
+        self.rateLimitWaitTime += delay
+        if rateLimited:
+            self.rateLimited += 1
+
+    # getValue() is read each time the metrics are exported
+    def setGauge(self, name, getValue):
+        self.gauges[name] = getValue
+
+    async def start(self, port=METRICS_PORT):
+        if self.lagTask is None:
+            self.lagTask = asyncio.ensure_future(self.__watchLoopLag())
+        if port and self.server is None:
+            self.server = await asyncio.start_server(self.__serve, METRICS_HOST, port)
+
+    async def __watchLoopLag(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = max(0.0, loop.time() - start - LAG_INTERVAL)
+            self.loopLag.observe(lag)
+            self.maxLoopLag = max(self.maxLoopLag, lag)
+
+    async def __serve(self, reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = self.export().encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: '
+                         + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # Prometheus text format
+    def export(self):
+        lines = ['# TYPE taraf_command_seconds histogram']
+        for command, histogram in sorted(self.latencies.items()):
+            lines += exportHistogram('taraf_command_seconds', histogram, 'command="' + command + '"')
+        lines.append('# TYPE taraf_api_calls_total counter')
+        for kind, count in sorted(self.apiCalls.items()):
+            lines.append('taraf_api_calls_total{kind="' + kind + '"} ' + str(count))
+        lines.append('# TYPE taraf_rate_limited_total counter')
+        lines.append('taraf_rate_limited_total ' + str(self.rateLimited))
+        lines.append('# TYPE taraf_rate_limit_waits_total counter')
+        lines.append('taraf_rate_limit_waits_total ' + str(self.rateLimitWaits))
+        lines.append('# TYPE taraf_rate_limit_wait_seconds_total counter')
+        lines.append('taraf_rate_limit_wait_seconds_total ' + repr(self.rateLimitWaitTime))
+        lines.append('# TYPE taraf_loop_lag_seconds histogram')
+        lines += exportHistogram('taraf_loop_lag_seconds', self.loopLag)
+        for name, getValue in sorted(self.gauges.items()):
+            lines.append('# TYPE ' + name + ' gauge')
+            lines.append(name + ' ' + str(getValue()))
+        return '\n'.join(lines) + '\n'
+
+
+def exportHistogram(name, histogram, labels=''):
+    lines = []
+    cumulated = 0
+    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+        cumulated += count
+        bucketLabels = (labels + ',' if labels else '') + 'le="' + ('+Inf' if bound == float('inf') else repr(bound)) + '"'
+        lines.append(name + '_bucket{' + bucketLabels + '} ' + str(cumulated))
+    suffix = '{' + labels + '}' if labels else ''
+    lines.append(name + '_sum' + suffix + ' ' + repr(histogram.sum))
+    lines.append(name + '_count' + suffix + ' ' + str(histogram.count))
+    return lines
+
+
+metrics = Metrics()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# Embeds of the bot. A Template holds what never changes for a kind of message
+# (title and colour) and render() fills it with the parts of one message into a
+# Content, a plain tuple that can be compared with what was sent last time.
+# buildEmbed() only turns a Content into a discord.Embed when it is sent, and
+# equal contents share the same cached embed.
+
+import discord
+from collections import namedtuple
+from functools import lru_cache
+
+CACHE_SIZE = 1024
+
+COLOURS = {
+    'blue': discord.Colour.dark_blue(),
+    'red': discord.Colour.red(),
+    'teal': discord.Colour.teal(),
+}
+
+# fields is a tuple of (name, value, inline)
+Content = namedtuple('Content', ['template', 'description', 'fields', 'footer'])
+
+
+class Template:
+    __slots__ = ('title', 'colour')
+
+    def __init__(self, title, color='blue'):
+        self.title = title
+        self.colour = COLOURS.get(color, COLOURS['blue'])
+
+    def render(self, description=None, fields=(), footer=None):
+        return Content(self, description, tuple(fields), footer)
+
+
+# Template of a one-off message, e.g. sendSimpleMessage
+@lru_cache(maxsize=CACHE_SIZE)
+def getTemplate(title, color='blue'):
+    return Template(title, color)
+
+
+# The embed is shared by every send of the same content, it must not be modified
+@lru_cache(maxsize=CACHE_SIZE)
+def buildEmbed(content):
+    embedMsg = discord.Embed(title=content.template.title, colour=content.template.colour,
+                             description=content.description)
+    for name, value, inline in content.fields:
+        embedMsg.add_field(name=name, value=value, inline=inline)
+    if content.footer:
+        embedMsg.set_footer(text=content.footer)
+    return embedMsg
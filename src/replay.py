@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# Replays the archived games (journal.Archive) at full speed. Each game is dealt
+# again from its seed and its actions go through the rules again: the events
+# must be the recorded ones, so a rule change that would have changed a past
+# game is reported with the first action that differs.
+#
+# python replay.py archives --workers 4
+# python replay.py archives --context --profile
+#
+# --context replays through GameContext instead, embeds, board and fake discord
+# calls included (see loadtest.py), to profile the bot on real games.
+
+import argparse
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import time
+from concurrent.futures import ProcessPoolExecutor
+import board
+import dispatcher
+import leaderboard
+from engine import TableState, apply
+from journal import toAction, listArchives, readArchive
+from loadtest import UNLIMITED, FakeApi, FakeChannel, FakeContext, FakeGuild, FakeUser
+from taraf import GameContext
+
+PROFILE_TOP = 25
+MAX_SHOWN = 10
+CHUNK_SIZE = 200
+
+
+# Number of actions replayed and, if the events differ from the recorded ones,
+# (index of the action, record, events produced instead)
+def replayGame(game):
+    state = TableState(game['seed'])
+    for index, record in enumerate(game['records']):
+        state, events = apply(state, toAction(record))
+        names = [event.type.name for event in events]
+        if names != record.get('ev', []):
+            return index + 1, (index, record, names)
+    return len(game['records']), None
+
+
+# chunk is a list of (where, game)
+def replayChunk(chunk):
+    actions = 0
+    divergences = []
+    for where, game in chunk:
+        nbOfActions, divergence = replayGame(game)
+        actions += nbOfActions
+        if divergence:
+            divergences.append((where,) + divergence)
+    return len(chunk), actions, divergences
+
+
+def getChunks(paths, size=CHUNK_SIZE):
+    chunk = []
+    for path in listArchives(paths):
+        for number, game in readArchive(path):
+            chunk.append((path + ':' + str(number), game))
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def replay(paths, workers=None):
+    games = actions = 0
+    divergences = []
+    executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count()) if workers != 1 else None
+    for chunkGames, chunkActions, chunkDivergences in (executor.map if executor else map)(replayChunk,
+                                                                                          getChunks(paths)):
+        games += chunkGames
+        actions += chunkActions
+        divergences += chunkDivergences
+    if executor:
+        executor.shutdown()
+    return games, actions, divergences
+
+
+# Same records through GameContext.run, one command at a time like on discord
+async def replayContext(paths, api):
+    dispatcher.dispatcher.globalBucket = dispatcher.TokenBucket(UNLIMITED, UNLIMITED)
+    dispatcher.ROUTE_RATE = dispatcher.ROUTE_BURST = UNLIMITED
+    board.COALESCE_DELAY = 0
+    leaderboard.leaderboard.path = ':memory:'
+    guild = FakeGuild()
+    games = actions = 0
+    for path in listArchives(paths):
+        for number, game in readArchive(path):
+            channel = FakeChannel(api, "replay")
+            users = {}
+            context = GameContext(game['seed'])
+            for record in game['records']:
+                name = record.get('name')
+                if record['t'] == 'join' and not record.get('bot'):
+                    user = users[name] = FakeUser(api, name)
+                    await context.addPlayer(FakeContext(api, guild, channel, user), user)
+                else:
+                    author = users.get(name) or next(iter(users.values()), None)
+                    await context.run(FakeContext(api, guild, channel, author), toAction(record))
+                    if record.get('bot'):
+                        context.bots.add(name)
+                await asyncio.sleep(0)  # lets the board be edited
+            await context.board.flush()
+            games += 1
+            actions += len(game['records'])
+    return games, actions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rejoue les parties archivées")
+    parser.add_argument('paths', nargs='*', default=['archives'], help="fichiers ou dossiers d'archives")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--context', action='store_true', help="rejoue avec GameContext et une fausse API discord")
+    parser.add_argument('--profile', action='store_true', help="profile le rejeu (dans un seul processus)")
+    args = parser.parse_args()
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    start = time.perf_counter()
+    if args.context:
+        api = FakeApi()
+        games, actions = asyncio.run(replayContext(args.paths, api))
+        divergences = []
+    else:
+        games, actions, divergences = replay(args.paths, 1 if profiler else args.workers)
+    elapsed = time.perf_counter() - start
+    if profiler:
+        profiler.disable()
+    print(str(games) + " parties, " + str(actions) + " actions rejouées en " + "%.2f" % elapsed + " s ("
+          + "%.0f" % (actions / elapsed if elapsed else 0) + " actions/s)")
+    if args.context:
+        print("appels API : " + ', '.join(kind + " " + str(count) for kind, count in sorted(api.requests.items())))
+    if profiler:
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        print(output.getvalue())
+    if divergences:
+        print(str(len(divergences)) + " partie(s) divergent :")
+        for where, index, record, names in divergences[:MAX_SHOWN]:
+            print(where + ", action " + str(index + 1) + " " + str(record) + " : attendu " + str(record.get('ev', []))
+                  + ", obtenu " + str(names))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
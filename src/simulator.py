@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# Monte Carlo simulator: plays whole arrays of rounds at once with NumPy, using
+# the rules of engine.py (deal, joker as 22 or 0, highest card takes the fold,
+# forbidden total for the last caller, |call - folds| shit points).
+#
+# python simulator.py --players 4 --games 1000000 --workers 8
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from engine import NB_OF_CARDS, JOKER, MIN_PLAYER, MAX_PLAYER
+from advisor import winProbabilities
+
+CALL_STRATEGIES = ('expected', 'random', 'zero')
+PLAY_STRATEGIES = ('greedy', 'high', 'low', 'random')
+BATCH_SIZE = 20000
+
+
+# hands[round, position, card] where position 0 is the dealer (first caller).
+# nbOfCards == 0 is the blind last turn: 1 card each and no joker.
+def dealRounds(rng, nbOfRounds, nbOfPlayers, nbOfCards):
+    if nbOfCards == 0:
+        deckSize, handSize = NB_OF_CARDS - 1, 1
+    else:
+        deckSize, handSize = NB_OF_CARDS, nbOfCards
+    decks = rng.permuted(np.tile(np.arange(1, deckSize + 1, dtype=np.int8), (nbOfRounds, 1)), axis=1)
+    # dealt one card per player at a time, like engine.dealCards
+    dealt = decks[:, :handSize * nbOfPlayers].reshape(nbOfRounds, handSize, nbOfPlayers)
+    return dealt.transpose(0, 2, 1)
+
+
+def callRounds(rng, hands, nbOfCards, strategy):
+    nbOfRounds, nbOfPlayers, handSize = hands.shape
+    maxNbOfCalls = max(nbOfCards, 1)
+    if strategy == 'zero':
+        calls = np.zeros((nbOfRounds, nbOfPlayers), dtype=np.int64)
+    elif strategy == 'random':
+        calls = rng.integers(0, handSize + 1, size=(nbOfRounds, nbOfPlayers))
+    elif nbOfCards == 0:
+        # Blind turn: a player only sees the others' cards
+        front = hands[:, :, 0].astype(np.int64)
+        highest = np.sort(front, axis=1)
+        othersMax = np.where(front == highest[:, -1:], highest[:, -2:-1], highest[:, -1:])
+        unseen = NB_OF_CARDS - 1 - (nbOfPlayers - 1)
+        calls = ((NB_OF_CARDS - 1 - othersMax) / unseen > 0.5).astype(np.int64)
+    else:
+        expected = np.array(winProbabilities(nbOfPlayers))[hands].sum(axis=2)
+        calls = np.clip(np.rint(expected), 0, handSize).astype(np.int64)
+    # The last caller can't make the total equal the number of folds
+    forbidden = calls.sum(axis=1) == maxNbOfCalls
+    last = calls[:, -1]
+    calls[:, -1] = np.where(forbidden, np.where(last < handSize, last + 1, last - 1), last)
+    return calls
+
+
+def playRounds(rng, hands, calls, strategy):
+    nbOfRounds, nbOfPlayers, handSize = hands.shape
+    highValues = hands.astype(np.int64)
+    lowValues = np.where(highValues == JOKER, 0, highValues)  # joker played as 0 to lose
+    remaining = np.ones(hands.shape, dtype=bool)
+    folds = np.zeros((nbOfRounds, nbOfPlayers), dtype=np.int64)
+    rows = np.arange(nbOfRounds)[:, None]
+    positions = np.arange(nbOfPlayers)[None, :]
+    for fold in range(handSize):
+        if strategy == 'greedy':
+            wantsFold = folds < calls
+        elif strategy == 'high':
+            wantsFold = np.ones(folds.shape, dtype=bool)
+        elif strategy == 'low':
+            wantsFold = np.zeros(folds.shape, dtype=bool)
+        else:
+            wantsFold = rng.random(folds.shape) < 0.5
+        if strategy == 'random':
+            choice = np.where(remaining, rng.random(hands.shape), -1).argmax(axis=2)
+        else:
+            high = np.where(remaining, highValues, -1).argmax(axis=2)
+            low = np.where(remaining, lowValues, JOKER + 1).argmin(axis=2)
+            choice = np.where(wantsFold, high, low)
+        played = np.where(wantsFold, highValues[rows, positions, choice], lowValues[rows, positions, choice])
+        remaining[rows, positions, choice] = False
+        folds[np.arange(nbOfRounds), played.argmax(axis=1)] += 1
+    return folds
+
+
+def simulateRounds(rng, nbOfRounds, nbOfPlayers, nbOfCards, callStrategy='expected', playStrategy='greedy'):
+    hands = dealRounds(rng, nbOfRounds, nbOfPlayers, nbOfCards)
+    calls = callRounds(rng, hands, nbOfCards, callStrategy)
+    folds = playRounds(rng, hands, calls, playStrategy)
+    return calls, folds, np.abs(calls - folds)
+
+
+# Every player deals once, each deal goes from 22 // nbOfPlayers cards down to
+# the blind turn. Returns the shit points of each seat (seat 0 deals first) and
+# the number of exact calls for each calling position (position 0 calls first).
+def simulateGames(rng, nbOfGames, nbOfPlayers, callStrategy='expected', playStrategy='greedy'):
+    nbOfTurns = NB_OF_CARDS // nbOfPlayers
+    shitPoints = np.zeros((nbOfGames, nbOfPlayers), dtype=np.int64)
+    hits = np.zeros(nbOfPlayers, dtype=np.int64)
+    for dealer in range(nbOfPlayers):
+        seats = (np.arange(nbOfPlayers) + dealer) % nbOfPlayers
+        for nbOfCards in range(nbOfTurns, -1, -1):
+            calls, folds, points = simulateRounds(rng, nbOfGames, nbOfPlayers, nbOfCards, callStrategy, playStrategy)
+            shitPoints[:, seats] += points
+            hits += (points == 0).sum(axis=0)
+    return shitPoints, hits
+
+
+def runShard(shard):
+    seed, nbOfGames, nbOfPlayers, callStrategy, playStrategy = shard
+    rng = np.random.default_rng(seed)
+    shitPoints, hits = simulateGames(rng, nbOfGames, nbOfPlayers, callStrategy, playStrategy)
+    best = shitPoints == shitPoints.min(axis=1, keepdims=True)
+    wins = (best / best.sum(axis=1, keepdims=True)).sum(axis=0)  # ties share the win
+    return nbOfGames, shitPoints.sum(axis=0), (shitPoints.astype(np.float64) ** 2).sum(axis=0), wins, hits
+
+
+def simulate(nbOfPlayers, nbOfGames, callStrategy='expected', playStrategy='greedy', seed=None,
+             workers=None, batchSize=BATCH_SIZE):
+    sizes = [batchSize] * (nbOfGames // batchSize)
+    if nbOfGames % batchSize:
+        sizes.append(nbOfGames % batchSize)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    shards = [(shardSeed, size, nbOfPlayers, callStrategy, playStrategy) for shardSeed, size in zip(seeds, sizes)]
+    total = 0
+    pointsSum = np.zeros(nbOfPlayers)
+    squaresSum = np.zeros(nbOfPlayers)
+    wins = np.zeros(nbOfPlayers)
+    hits = np.zeros(nbOfPlayers, dtype=np.int64)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for games, points, squares, shardWins, shardHits in executor.map(runShard, shards):
+            total += games
+            pointsSum += points
+            squaresSum += squares
+            wins += shardWins
+            hits += shardHits
+    mean = pointsSum / total
+    nbOfRounds = total * nbOfPlayers * (NB_OF_CARDS // nbOfPlayers + 1)  # rounds played by each position
+    return {
+        'games': total,
+        'rounds': nbOfRounds,
+        'meanShitPoints': mean,
+        'stdShitPoints': np.sqrt(np.maximum(squaresSum / total - mean ** 2, 0)),
+        'winRate': wins / total,
+        'callAccuracy': hits / nbOfRounds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulateur de parties de tarot africain")
+    parser.add_argument('--players', type=int, default=4, choices=range(MIN_PLAYER, MAX_PLAYER + 1))
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--call', default='expected', choices=CALL_STRATEGIES)
+    parser.add_argument('--play', default='greedy', choices=PLAY_STRATEGIES)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = simulate(args.players, args.games, args.call, args.play, args.seed, args.workers, args.batch)
+    elapsed = time.perf_counter() - start
+    print(str(result['games']) + " parties, " + str(result['rounds']) + " tours en " + "%.1f" % elapsed + " s ("
+          + "%.0f" % (result['rounds'] / elapsed * 60) + " tours/min)")
+    for seat in range(args.players):
+        print("siège " + str(seat) + " : " + "%.2f" % result['meanShitPoints'][seat] + " shit points (écart type "
+              + "%.2f" % result['stdShitPoints'][seat] + "), victoires " + "%.1f%%" % (100 * result['winRate'][seat]))
+    for position in range(args.players):
+        print("position " + str(position) + " : calls réussis " + "%.1f%%" % (100 * result['callAccuracy'][position]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+# Exact solver for small rounds, with every hand known (post-game analysis).
+# Each player plays to minimize his own |call - folds| (max^n search), states
+# are memoized in a transposition table under a canonical key:
+# - positions are rotated so the player leading the fold comes first,
+# - cards are replaced by their rank among the cards still in play, so rounds
+#   that only differ by the value of already played cards share their entry,
+# - needs (call - folds taken) are clamped to the folds left to play,
+# - two cards of a hand with no other card between them are the same move.
+#
+# python solver.py --players 6 --cards 3 --seed 1
+# python solver.py --archives archives (optimal against actual on the rounds of
+# at most --max-cards cards of the archived games)
+
+import argparse
+import time
+from random import Random
+from engine import NB_OF_CARDS, JOKER, MIN_PLAYER, MAX_PLAYER, EventType, TableState, apply, cardsOf, countCards, \
+    firstCard
+from journal import toAction, listArchives, readArchive
+
+JOKER_RANK = 31  # the joker keeps its own bit in canonical hands
+MAX_ANALYSED_CARDS = 2  # rounds of 3 cards take seconds each
+MAX_TABLE_ENTRIES = 1000000
+
+
+def toHand(cards):
+    hand = 0
+    for card in cards:
+        hand |= 1 << card
+    return hand
+
+
+class Solver:
+    def __init__(self):
+        self.table = {}
+        self.nodes = 0
+
+    def __getKey(self, hands, needs, leader, offset, highest, owner):
+        nbOfPlayers = len(hands)
+        inPlay = 0
+        for hand in hands:
+            inPlay |= hand
+        inPlay &= ~(1 << JOKER)
+        if 0 < highest < JOKER:
+            inPlay |= 1 << highest
+        ranks = {}
+        for rank, card in enumerate(cardsOf(inPlay)):
+            ranks[card] = rank + 1
+        ranks[JOKER] = JOKER_RANK
+        foldsLeft = countCards(hands[leader]) + (1 if offset else 0)
+        canonicalHands = []
+        canonicalNeeds = []
+        for step in range(nbOfPlayers):
+            position = (leader + step) % nbOfPlayers
+            canonical = 0
+            for card in cardsOf(hands[position]):
+                canonical |= 1 << ranks[card]
+            canonicalHands.append(canonical)
+            canonicalNeeds.append(min(max(needs[position], 0), foldsLeft))
+        return (tuple(canonicalHands), tuple(canonicalNeeds), offset, ranks.get(highest, 0),
+                -1 if owner is None else (owner - leader) % nbOfPlayers)
+
+    # Cards worth trying: the joker high and low, and one card per run of
+    # consecutive cards nobody else can slip between
+    def __getMoves(self, hand, others, highest):
+        blockers = others & ~(1 << JOKER)
+        if 0 < highest < JOKER:
+            blockers |= 1 << highest
+        moves = []
+        previous = None
+        for card in cardsOf(hand):
+            if card == JOKER:
+                moves.append((card, JOKER))
+                moves.append((card, 0))
+            elif previous is None or blockers >> previous & ((1 << (card - previous)) - 1) != 0:
+                moves.append((card, card))
+            previous = card
+        return moves
+
+    # Future folds of every position when everybody plays optimally
+    def search(self, hands, needs, leader=0, offset=0, highest=0, owner=None):
+        nbOfPlayers = len(hands)
+        if offset == nbOfPlayers:  # fold is over
+            folds = [0] * nbOfPlayers
+            if hands[owner]:
+                needs = list(needs)
+                needs[owner] -= 1
+                folds = list(self.search(hands, needs, owner))
+            folds[owner] += 1
+            return tuple(folds)
+        key = self.__getKey(hands, needs, leader, offset, highest, owner)
+        result = self.table.get(key)
+        if result is not None:
+            return result[nbOfPlayers - leader:] + result[:nbOfPlayers - leader]
+        self.nodes += 1
+        position = (leader + offset) % nbOfPlayers
+        others = 0
+        for other in range(nbOfPlayers):
+            if other != position:
+                others |= hands[other]
+        best = None
+        bestPenalty = None
+        for card, value in self.__getMoves(hands[position], others, highest):
+            nextHands = list(hands)
+            nextHands[position] &= ~(1 << card)
+            if value > highest:
+                folds = self.search(nextHands, needs, leader, offset + 1, value, position)
+            else:
+                folds = self.search(nextHands, needs, leader, offset + 1, highest, owner)
+            penalty = abs(needs[position] - folds[position])
+            if best is None or penalty < bestPenalty:
+                best = folds
+                bestPenalty = penalty
+        self.table[key] = best[leader:] + best[:leader]
+        return best
+
+    def solvePlay(self, hands, calls):
+        return self.search(tuple(hands), tuple(calls))
+
+    # Calls made in turn, each caller knowing every hand and anticipating the
+    # next callers; the last caller can't make the total equal the folds
+    def solveCalls(self, hands, maxNbOfCalls=None):
+        nbOfPlayers = len(hands)
+        nbOfCards = countCards(hands[0])
+        if maxNbOfCalls is None:
+            maxNbOfCalls = nbOfCards
+        hands = tuple(hands)
+
+        def callSearch(calls):
+            position = len(calls)
+            if position == nbOfPlayers:
+                return calls, self.search(hands, calls)
+            best = None
+            for call in range(nbOfCards + 1):
+                if position == nbOfPlayers - 1 and sum(calls) + call == maxNbOfCalls:
+                    continue
+                result = callSearch(calls + (call,))
+                if best is None or abs(call - result[1][position]) < abs(best[0][position] - best[1][position]):
+                    best = result
+                    if call == result[1][position]:
+                        break  # can't do better than an exact call
+            return best
+
+        return callSearch(())
+
+    # What each player should have called, the others' calls being the actual ones
+    def bestResponseCalls(self, hands, calls, maxNbOfCalls=None):
+        nbOfPlayers = len(hands)
+        nbOfCards = countCards(hands[0])
+        if maxNbOfCalls is None:
+            maxNbOfCalls = nbOfCards
+        bestCalls = []
+        for position in range(nbOfPlayers):
+            best = None
+            for call in range(nbOfCards + 1):
+                tried = list(calls)
+                tried[position] = call
+                if sum(tried) == maxNbOfCalls and position == nbOfPlayers - 1:
+                    continue
+                penalty = abs(call - self.search(tuple(hands), tuple(tried))[position])
+                if best is None or penalty < best[0]:
+                    best = (penalty, call)
+            bestCalls.append(best[1])
+        return bestCalls
+
+
+# Blind last turn: each player only sees the others' card and the play is
+# forced, so the best call only depends on the chance of holding the highest card
+def solveBlindCalls(frontCards):
+    nbOfPlayers = len(frontCards)
+    unseen = NB_OF_CARDS - 1 - (nbOfPlayers - 1)
+    calls = []
+    chances = []
+    for position in range(nbOfPlayers):
+        othersMax = max(card for other, card in enumerate(frontCards) if other != position)
+        chance = (NB_OF_CARDS - 1 - othersMax) / unseen
+        call = 1 if chance > 0.5 else 0
+        if position == nbOfPlayers - 1 and sum(calls) + call == 1:
+            call = 1 - call
+        calls.append(call)
+        chances.append(chance)
+    return calls, chances
+
+
+# Optimal against actual for a round whose hands and calls are known
+def analyseRound(hands, calls, solver=None):
+    solver = solver or Solver()
+    optimalFolds = solver.solvePlay(hands, calls)
+    return {
+        'optimalFolds': optimalFolds,
+        'optimalPenalties': tuple(abs(call - folds) for call, folds in zip(calls, optimalFolds)),
+        'bestResponseCalls': solver.bestResponseCalls(hands, calls),
+    }
+
+
+# Rounds of the archived games (journal.Archive) small enough to be solved,
+# replayed through the rules: (nbOfCards, hands, calls, actual folds), hands and
+# calls from the dealer, who leads the first fold
+def getArchivedRounds(paths, maxCards=MAX_ANALYSED_CARDS):
+    for path in listArchives(paths):
+        for number, game in readArchive(path):
+            state = TableState(game['seed'])
+            hands = calls = None
+            for record in game['records']:
+                state, events = apply(state, toAction(record))
+                for event in events:
+                    if event.type == EventType.CALLING_OVER and 0 < state.currentTurn <= maxCards:
+                        hands = [player.hand for player in state.players]
+                        calls = [player.call for player in state.players]
+                    elif event.type == EventType.TURN_SCORED and hands:
+                        yield countCards(hands[0]), hands, calls, [player.foldTaken for player in event.view.players]
+                        hands = calls = None
+
+
+# Shit points taken on the archived rounds against those of an optimal play of
+# the same calls, and how often a call was the best response to the others
+def analyseArchives(paths, maxCards=MAX_ANALYSED_CARDS):
+    totals = {}
+    solver = Solver()
+    for nbOfCards, hands, calls, folds in getArchivedRounds(paths, maxCards):
+        if len(solver.table) > MAX_TABLE_ENTRIES:
+            solver = Solver()  # rounds of other games rarely share positions
+        analysis = analyseRound(hands, calls, solver)
+        total = totals.setdefault(nbOfCards, [0, 0, 0, 0, 0])
+        total[0] += 1
+        total[1] += sum(abs(call - taken) for call, taken in zip(calls, folds))
+        total[2] += sum(analysis['optimalPenalties'])
+        total[3] += sum(call == best for call, best in zip(calls, analysis['bestResponseCalls']))
+        total[4] += len(calls)
+    return totals
+
+
+# nbOfCards == 0 is the blind last turn: 1 card each and no joker
+def dealHands(rng, nbOfPlayers, nbOfCards):
+    if nbOfCards == 0:
+        deck, nbOfCards = list(range(1, NB_OF_CARDS)), 1
+    else:
+        deck = list(range(1, NB_OF_CARDS + 1))
+    rng.shuffle(deck)
+    return [toHand(deck[position * nbOfCards:(position + 1) * nbOfCards]) for position in range(nbOfPlayers)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solveur exact des petits tours")
+    parser.add_argument('--players', type=int, default=4, choices=range(MIN_PLAYER, MAX_PLAYER + 1))
+    parser.add_argument('--cards', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--archives', nargs='+', help="analyse les petits tours des parties archivées")
+    parser.add_argument('--max-cards', type=int, default=MAX_ANALYSED_CARDS, help="cartes des tours analysés")
+    args = parser.parse_args()
+
+    if args.archives:
+        start = time.perf_counter()
+        totals = analyseArchives(args.archives, args.max_cards)
+        for nbOfCards, (rounds, actual, optimal, bestCalls, nbOfCalls) in sorted(totals.items()):
+            print(str(nbOfCards) + " carte(s) : " + str(rounds) + " tours, shit points " + "%.2f" % (actual / rounds)
+                  + " par tour (jeu optimal " + "%.2f" % (optimal / rounds) + "), calls optimaux "
+                  + "%.0f%%" % (100 * bestCalls / nbOfCalls))
+        print("%.2f" % (time.perf_counter() - start) + " s")
+        return
+
+    hands = dealHands(Random(args.seed), args.players, args.cards)
+    for position, hand in enumerate(hands):
+        print("position " + str(position) + " : " + ', '.join(str(card) for card in cardsOf(hand)))
+    if args.cards == 0:
+        calls, chances = solveBlindCalls([firstCard(hand) for hand in hands])
+        print("calls à l'aveugle : " + str(calls) + ", chances : " + ', '.join("%.2f" % chance for chance in chances))
+    solver = Solver()
+    start = time.perf_counter()
+    calls, folds = solver.solveCalls(hands, max(args.cards, 1))
+    elapsed = time.perf_counter() - start
+    print("calls optimaux : " + str(list(calls)) + ", plis : " + str(list(folds)))
+    print(str(solver.nodes) + " noeuds, " + str(len(solver.table)) + " entrées, " + "%.2f" % elapsed + " s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from enum import Enum
+from engine import countCards
+from taraf import GameContext, TurnState, dprint, sendSimpleMessage
+from journal import JOURNAL_DIR, Journal, listJournals
+from metrics import metrics
+from timers import timerWheel
+
+# A player who doesn't call or play within TURN_TIMEOUT seconds is played for
+TURN_TIMEOUT = 90
+# Tables without any command for TABLE_TTL seconds are closed, and the least
+# recently used table is closed when there are more than MAX_TABLES. Tournament
+# tables are left to their tournament, which closes them when it ends.
+TABLE_TTL = 3600
+MAX_TABLES = 1000
+EVICTION_INTERVAL = 60
+
+
+class TableClosed(Exception):
+    pass
+
+
+class GameState(Enum):
+    NOT_STARTED = 1
+    SIGNIN = 2
+    STARTED = 3
+
+
+# One table per (guild, channel). Every command of a table goes through its queue
+# and is run by a single worker task, so two commands of the same table never
+# interleave while different tables run side by side.
+class Table:
+    def __init__(self, key, channel, journal=None):
+        self.key = key
+        self.channel = channel
+        self.state = GameState.NOT_STARTED
+        self.journal = journal
+        self.theGame = self.newGame()
+        self.ctx = None
+        self.lastActive = time.monotonic()
+        self.turnTimer = None
+        self.armedPosition = None
+        self.tournament = None
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.ensure_future(self.__run())
+
+    async def __run(self):
+        future = None
+        try:
+            while True:
+                command, args, future = await self.queue.get()
+                try:
+                    result = await command(*args)
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                try:
+                    if self.journal and self.journal.shouldSnapshot():
+                        self.journal.snapshot(self.dump())
+                    self.__armTurnTimer()
+                except Exception as error:  # the journal is still whole, the next snapshot tries again
+                    print("Erreur de la table " + str(self.key) + " : " + repr(error))
+        finally:
+            # closed: the command running and those waiting won't be run
+            if future and not future.done():
+                future.set_exception(TableClosed("Table fermée"))
+            while not self.queue.empty():
+                command, args, future = self.queue.get_nowait()
+                future.set_exception(TableClosed("Table fermée"))
+
+    # Called with the context of each command received for the table
+    def touch(self, ctx):
+        self.ctx = ctx
+        self.lastActive = time.monotonic()
+
+    # Where the game stands: the timer is only rearmed when it moved on, not on
+    # !hint, !show or a command refused to a player who isn't the one expected
+    def getTurnPosition(self):
+        state = self.theGame.state
+        return (self.theGame, state.turnState, state.currentTurn, state.dealer, state.currentPlayer,
+                sum(countCards(player.hand) for player in state.seats))
+
+    def __armTurnTimer(self):
+        position = self.getTurnPosition()
+        if position == self.armedPosition:
+            return
+        self.armedPosition = position
+        timerWheel.cancel(self.turnTimer)
+        self.turnTimer = None
+        if self.state == GameState.STARTED and self.ctx and position[1] in (TurnState.CALLING, TurnState.PLAYING):
+            self.turnTimer = timerWheel.schedule(TURN_TIMEOUT, self.__onTurnTimeout, position)
+
+    async def __onTurnTimeout(self, position):
+        self.turnTimer = None
+        try:
+            await self.submit(self.autoPlay, position)
+        except Exception as error:
+            print("Erreur pendant le jeu automatique : " + repr(error))
+
+    async def autoPlay(self, position):
+        if self.getTurnPosition() == position:  # nobody played since the timer was armed
+            await self.theGame.autoPlay(self.ctx)
+
+    # The seed is journaled so a replay deals the same cards
+    def newGame(self):
+        seed = random.getrandbits(64)
+        if self.journal:
+            self.journal.append({'t': 'open', 'channel': self.channel, 'seed': seed})
+        return GameContext(seed, self.journal)
+
+    def dump(self):
+        return {'state': self.state.name, 'channel': self.channel, 'game': self.theGame.dump()}
+
+    # Rebuilds the table from its last snapshot and the records written after it.
+    # users maps the user ids found in the journal to discord users.
+    def restore(self, snapshot, records, users):
+        if snapshot:
+            self.state = GameState[snapshot['state']]
+            self.channel = snapshot['channel']
+            self.theGame.restore(snapshot['game'], users)
+        for record in records:
+            if record['t'] == 'open':
+                self.channel = record['channel']
+                self.state = GameState.NOT_STARTED
+                self.theGame = GameContext(record['seed'])
+            elif record['t'] == 'signin':
+                self.state = GameState.SIGNIN
+            else:
+                self.theGame.replay(record, users.get(record.get('user')))
+                if record['t'] == 'go' and self.theGame.state.turnState != TurnState.WAITING:
+                    self.state = GameState.STARTED
+
+    def attach(self, journal):
+        self.journal = journal
+        self.theGame.journal = journal
+
+    # The latency of a command includes its wait in the queue
+    async def submit(self, command, *args):
+        if self.worker.done():
+            raise TableClosed("Table fermée")
+        start = time.perf_counter()
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((command, args, future))
+        try:
+            return await future
+        finally:
+            metrics.observeCommand(command.__name__, time.perf_counter() - start)
+
+    def close(self, removeJournal=False):
+        self.worker.cancel()
+        timerWheel.cancel(self.turnTimer)
+        if self.journal:
+            asyncio.ensure_future(self.journal.close(removeJournal))
+
+    async def start(self, ctx):
+        if self.state == GameState.NOT_STARTED:
+            self.state = GameState.SIGNIN
+            if self.journal:
+                self.journal.append({'t': 'signin'})
+            await sendSimpleMessage(ctx, "!join pour rejoindre")
+        else:
+            await sendSimpleMessage(ctx, "Partie déjà en cours", color='red')
+
+    async def stop(self, ctx):
+        if self.tournament:
+            await sendSimpleMessage(ctx, "Table de tournoi, seul l'organisateur peut l'arrêter", color='red')
+        elif await self.theGame.isThisPlayerMaster(ctx.message.author.name):
+            dprint("!stop")
+            self.reset()
+            await sendSimpleMessage(ctx, "La partie a été reset")
+
+    def reset(self):
+        self.theGame = self.newGame()
+        self.state = GameState.NOT_STARTED
+
+    # Seats the given users and deals right away, for tournament tables.
+    # onGameOver(view) is called when the game ends.
+    async def seat(self, ctx, users, onGameOver):
+        self.reset()
+        self.theGame.onGameOver = onGameOver
+        self.state = GameState.SIGNIN
+        if self.journal:
+            self.journal.append({'t': 'signin'})
+        for user in users:
+            await self.theGame.addPlayer(ctx, user)
+        await self.go(ctx)
+
+    async def join(self, ctx):
+        if self.state == GameState.SIGNIN:
+            await self.theGame.addPlayer(ctx)
+        else:
+            await sendSimpleMessage(ctx, "Pas possible de rejoindre", color='red')
+
+    async def bot(self, ctx):
+        if self.state == GameState.SIGNIN:
+            await self.theGame.addBot(ctx)
+        else:
+            await sendSimpleMessage(ctx, "Pas possible de rejoindre", color='red')
+
+    async def go(self, ctx):
+        if self.state == GameState.SIGNIN:
+            await self.theGame.startGame(ctx)
+            if self.theGame.state.turnState != TurnState.WAITING:
+                self.state = GameState.STARTED
+        else:
+            await sendSimpleMessage(ctx, "Il faut d'abord ouvrir les inscriptions")
+
+    async def call(self, ctx, call):
+        if self.state == GameState.STARTED:
+            await self.theGame.handlePlayerCall(ctx, call)
+
+    async def play(self, ctx, card):
+        if self.state == GameState.STARTED:
+            await self.theGame.handleCardPlayed(ctx, ctx.message.author.name, card)
+
+
+# Tables are kept from the least to the most recently used
+class TableRegistry:
+    # directory=None keeps the tables in memory only
+    def __init__(self, directory=JOURNAL_DIR, ttl=TABLE_TTL, maxTables=MAX_TABLES):
+        self.tables = OrderedDict()
+        self.directory = directory
+        self.ttl = ttl
+        self.maxTables = maxTables
+        self.evictionTimer = None
+        metrics.setGauge('taraf_active_tables', self.__len__)
+        metrics.setGauge('taraf_timers', timerWheel.__len__)
+
+    @staticmethod
+    def getKey(ctx):
+        guild = ctx.guild.id if ctx.guild else None
+        return guild, ctx.message.channel.id
+
+    def get(self, ctx):
+        key = self.getKey(ctx)
+        table = self.tables.get(key)
+        if table:
+            table.touch(ctx)
+            self.tables.move_to_end(key)
+        return table
+
+    def getOrOpen(self, ctx):
+        table = self.get(ctx)
+        if table is None:
+            key = self.getKey(ctx)
+            journal = Journal(key, self.directory) if self.directory else None
+            table = Table(key, ctx.message.channel.name, journal)
+            table.touch(ctx)
+            self.tables[key] = table
+            dprint("Nouvelle table : " + str(key))
+            overflow = len(self.tables) - self.maxTables
+            if overflow > 0:
+                for oldKey in [oldKey for oldKey, other in self.tables.items()
+                               if not other.tournament and oldKey != key][:overflow]:
+                    self.evict(oldKey)
+            self.__scheduleEviction()
+        return table
+
+    def close(self, key, removeJournal=False):
+        table = self.tables.pop(key, None)
+        if table:
+            table.close(removeJournal)
+
+    # An evicted game is abandoned, its journal goes with it
+    def evict(self, key):
+        table = self.tables.get(key)
+        if table and table.ctx and table.state != GameState.NOT_STARTED:
+            asyncio.ensure_future(sendSimpleMessage(table.ctx, "Table fermée pour inactivité", color='red'))
+        self.close(key, removeJournal=True)
+        dprint("Table fermée : " + str(key))
+
+    def __scheduleEviction(self):
+        if self.evictionTimer is None:
+            self.evictionTimer = timerWheel.schedule(EVICTION_INTERVAL, self.__evictIdleTables)
+
+    def __evictIdleTables(self):
+        self.evictionTimer = None
+        limit = time.monotonic() - self.ttl
+        for key, table in list(self.tables.items()):
+            if table.lastActive > limit:
+                break
+            if not table.tournament:
+                self.evict(key)
+        if self.tables:
+            self.__scheduleEviction()
+
+    # Reopens the tables found in the journals. getUser(userId) is a coroutine
+    # returning the discord user, or None if the user can't be found anymore.
+    # isOwned(key) picks the tables of this process, see workers.py
+    async def recover(self, getUser, isOwned=None):
+        if not self.directory:
+            return
+        for key in listJournals(self.directory):
+            if key in self.tables or (isOwned and not isOwned(key)):
+                continue
+            journal = Journal(key, self.directory)
+            snapshot, records = journal.load()
+            userIds = set(snapshot['game']['users'].values()) if snapshot else set()
+            userIds.update(record['user'] for record in records if 'user' in record)
+            users = {}
+            for userId in userIds:
+                users[userId] = await getUser(userId)
+            table = Table(key, None)
+            table.restore(snapshot, records, users)
+            table.attach(journal)
+            self.tables[key] = table
+            self.__scheduleEviction()
+            dprint("Table restaurée : " + str(key) + " (" + str(len(records)) + " actions rejouées)")
+
+    def __len__(self):
+        return len(self.tables)
@@ -1,184 +1,245 @@
 # -*- coding: utf-8 -*-
 
-from enum import Enum
-from random import shuffle
-import discord
-
-# MIN and MAX values are inclusive (>=, <=)
-MIN_PLAYER = 2
-MAX_PLAYER = 6
-CHEAT_ON = True
-DEBUG_ON = False
-
-
-# Debug print
-def dprint(string):
-    if DEBUG_ON:
-        print(string)
-
-
-# Cheat print
-def cprint(string):
-    if CHEAT_ON:
-        print(string)
+# Discord side of the game: GameContext feeds the actions of the players to the
+# rules engine (engine.py) and renders the resulting events.
 
-async def initNormalEmbed(message, description):
-    return discord.Embed(title=message, color=discord.Colour.dark_blue(), description=description)
-async def initErrorEmbed(message, description):
-    return discord.Embed(title=message, color=discord.Colour.red(), description=description)
-async def initTealEmbed(message, description):
-    return discord.Embed(title=message, color=discord.Colour.teal(), description=description)
+import asyncio
+import time
+import discord
+from render import Template, getTemplate, buildEmbed
+from dispatcher import dispatcher, channelRoute, dmRoute
+from board import StatusBoard
+from advisor import probabilityEngine, getSituation, getAllowedCalls, adviseCall, chooseCall, choosePlay
+from journal import toRecord, toAction, archive
+from analytics import GameRecorder, getGameId, columnWriter
+from leaderboard import leaderboard, getResults
+from engine import MIN_PLAYER, MAX_PLAYER, JOKER, CHEAT_ON, DEBUG_ON, dprint, cprint, TurnState, EventType, \
+    TableState, Join, Go, Call, Play, apply
 
-async def initEmbedHeader(header, color='blue', description=None):
-    switcher = {
-        'blue': await initNormalEmbed(header, description),
-        'red': await initErrorEmbed(header, description),
-        'teal': await initTealEmbed(header, description)
-    }
-    embedHeader = switcher.get(color, await initNormalEmbed(header, description))
-    return embedHeader
 
 async def sendSimpleMessage(ctx, message, color='blue', description=None):
-    embedMsg = await initEmbedHeader(message, color, description)
-    await ctx.send(embed=embedMsg)
-
-async def sendMsgToPlayer(message, user, color='blue', description=None):
-    embedMsg = await initEmbedHeader(message, color, description)
-    await user.send(embed=embedMsg)
-
-class TurnState(Enum):
-    WAITING = 1
-    CALLING = 2
-    PLAYING = 3
-    PLAYING_OVER = 4
-
-
-class Player:
-    def __init__(self, name, isMaster, user):
-        self.name = name
-        self.isMaster = bool(isMaster)
-        self.cards = []
-        self.call = 0
-        self.foldTaken = 0
-        self.shitPoints = 0
-        self.user = user
-        self.cardPlayed = "NA"
-
+    embedMsg = buildEmbed(getTemplate(message, color).render(description))
+    await dispatcher.call(channelRoute(ctx.message.channel), ctx.send, embed=embedMsg)
 
-async def getActualCard(card):
-    if card == 0:
-        return 22
-    else:
-        return card
+async def sendMsgToPlayer(content, user):
+    return await dispatcher.call(dmRoute(user), user.send, embed=buildEmbed(content))
 
+async def editMsgToPlayer(dm, content, user):
+    await dispatcher.call(dmRoute(user), dm.edit, embed=buildEmbed(content))
+    return dm
 
-class Deck:
-    def __init__(self):
-        self.cards = []
 
-    async def shuffle(self, nbOfCards):
-        self.cards = []
-        for card in range(nbOfCards):
-            self.cards.append(card + 1)
-        shuffle(self.cards)
+# Hand DM of a player, edited in place each time the hand changes
+class HandMessage:
+    def __init__(self, user):
+        self.user = user
+        self.message = None
+        self.content = None
+
+
+NEW_TURN = Template("Nouveau tour :", 'teal')
+CALLING_SUMMARY = Template("Résumé des calls :")
+PLAYING_SUMMARY = Template("Cartes jouées :")
+LAST_TURN = Template("Dernier tour :", 'teal')
+FOLD_SUMMARY = Template("Résumé des plis :")
+SHIT_POINTS = Template("Distrubution des shit points :")
+GAME_OVER = Template("PARTIE FINIE !", 'red')
+LEADERBOARD = Template("Classement :", 'teal')
+HINT = Template("Conseil :")
+PERF = Template("Performances :", 'teal')
+PROFILE = Template("Profil :", 'teal')
+HAND = Template("Vos cartes :")
+FRONT_CARDS = Template("Cartes sur le front des autres :")
+
+
+def getNbOfCallsString(view):
+    return "Nombre de call : " + str(view.sumOfCalls) + "/" + str(view.maxNbOfCalls)
+
+def getNextCallerField(view):
+    return "Prochain caller (!call x) :", view.currentPlayer, False
+
+def getNextPlayerField(view):
+    return "Prochain joueur (!play x) :", view.currentPlayer, False
+
+def getFirstPlayerField(view):
+    return "Premier joueur du tour (!play x) :", view.currentPlayer, False
+
+def initNewTurnMsg(view):
+    return NEW_TURN.render(getNbOfCallsString(view), [getNextCallerField(view)])
+
+def initCallingSummary(view, *extraFields):
+    fields = [(caller.name, str(caller.call), True) for caller in view.players]
+    return CALLING_SUMMARY.render(getNbOfCallsString(view), fields + list(extraFields))
+
+def initPlayingSummary(view, *extraFields):
+    fields = [(player.name, str(player.cardPlayed), True) for player in view.players]
+    return PLAYING_SUMMARY.render("C'est " + str(view.highestCardOwner) + " qui a la main avec " + str(view.highestCard),
+                                  fields + list(extraFields))
+
+def initFoldSummary(view, *extraFields):
+    fields = [(player.name, str(player.foldTaken) + "/" + str(player.call), True) for player in view.players]
+    return FOLD_SUMMARY.render(fields=fields + list(extraFields))
+
+def initLastTurnMsg(view):
+    fields = [(player.name, "carte " + player.cardPlayed + ", call " + str(player.call) + ", pli(s) "
+               + str(player.foldTaken) + ", +" + str(abs(player.call - player.foldTaken))
+               + " (" + str(player.shitPoints) + ")", False) for player in view.players]
+    return LAST_TURN.render("C'est " + str(view.highestCardOwner) + " qui remporte le pli avec " + str(view.highestCard),
+                            fields)
+
+def initShitPointsMsg(view):
+    return SHIT_POINTS.render(fields=[(player.name, "+" + str(abs(player.call - player.foldTaken))
+                                       + " (" + str(player.shitPoints) + ")", True) for player in view.players])
+
+def initGameOverMsg(view):
+    return GAME_OVER.render("scores finaux :", [(player.name, str(player.shitPoints), True) for player in view.players])
+
+def initLeaderboard(rows):
+    return LEADERBOARD.render(fields=[(str(rank + 1) + ". " + stats.player,
+                                       str(stats.wins) + " victoire(s) en " + str(stats.games) + " partie(s), "
+                                       + "%.1f" % stats.averageShitPoints + " shit points par partie", False)
+                                      for rank, stats in enumerate(rows)])
+
+def initStandingsMsg(title, standings):
+    return getTemplate(title, 'teal').render(fields=[(str(rank + 1) + ". " + standing.name,
+                                                      str(standing.shitPoints) + " shit points, " + str(standing.wins)
+                                                      + " victoire(s) en " + str(standing.games) + " partie(s)", False)
+                                                     for rank, standing in enumerate(standings)])
+
+def initPerfMsg(metrics):
+    fields = [(command, str(histogram.count) + " fois, p50 < " + "%g" % (1000 * histogram.quantile(0.5))
+               + " ms, p99 < " + "%g" % (1000 * histogram.quantile(0.99)) + " ms", False)
+              for command, histogram in sorted(metrics.latencies.items())]
+    fields.append(("Appels API", ', '.join(kind + " " + str(count) for kind, count in sorted(metrics.apiCalls.items()))
+                   or "aucun", False))
+    fields.append(("Rate limit", str(metrics.rateLimited) + " 429, " + str(metrics.rateLimitWaits) + " attentes ("
+                   + "%.1f" % metrics.rateLimitWaitTime + " s)", False))
+    fields.append(("Boucle", "lag max " + "%.0f" % (1000 * metrics.maxLoopLag) + " ms, p99 < "
+                   + "%g" % (1000 * metrics.loopLag.quantile(0.99)) + " ms", False))
+    description = ', '.join(name + " : " + str(getValue()) for name, getValue in sorted(metrics.gauges.items()))
+    return PERF.render(description, fields)
+
+def initProfileMsg(report):
+    samples, inclusive, exclusive = report
+    def getLines(counts):
+        return '\n'.join("%.0f%% " % (100 * count / samples) + name for name, count in counts) or "rien"
+    return PROFILE.render(str(samples) + " échantillons", [("Temps total", getLines(inclusive), False),
+                                                            ("Temps propre", getLines(exclusive), False)])
+
+def initPlayerStats(stats):
+    return getTemplate("Stats de " + stats.player + " :", 'teal').render(fields=[
+        ("Parties", str(stats.games), True),
+        ("Victoires", str(stats.wins) + " (" + "%.0f%%" % (100 * stats.wins / stats.games) + ")", True),
+        ("Shit points", "%.1f" % stats.averageShitPoints + " par partie, " + str(stats.bestShitPoints) + " au mieux", True),
+    ])
 
 
 class GameContext:
-    def __init__(self):
-        # Recurent infos
-        self.turnState = TurnState.WAITING
-        self.players = []
-        self.deck = Deck()
-        self.nbOfTurns = 0
-        self.currentTurn = 0
-        self.currentPlayer = 0
-        self.firstPlayer = 0
-        self.firstDealer = None
-        self.lastMessage = None
-        # DealerTurn based infos
-        self.sumOfCalls = 0
-        self.maxNbOfCalls = 99
-        # Fold based infos
-        self.highestCard = 0
-        self.highestCardOwner = None
-        print("Bot running")
-
-    async def __getPlayerByName(self, name):
-        for player in self.players:
-            if player.name == name:
-                return player
-
-    async def __getPlayerPosition(self, name):
-        position = 0
-        for player in self.players:
-            if player.name == name:
-                return position
-            position += 1
-        return 99
-
-    async def __startCallingPhase(self):
-        dprint("Starting calling phase")
-        self.turnState = TurnState.CALLING
-        self.sumOfCalls = 0
-        self.firstPlayer = 0
-        self.currentPlayer = self.firstPlayer
-        if self.currentTurn == 0:
-            self.maxNbOfCalls = 1
-        else:
-            self.maxNbOfCalls = self.currentTurn
-        # Reseting fold taken
-        for player in self.players:
-            player.foldTaken = 0
-            player.call = "NA"
-        self.lastMessage = None
-
-    async def __startPlayingPhase(self):
-        dprint("Starting playing phase")
-        self.turnState = TurnState.PLAYING
-        self.firstPlayer = 0
-        self.currentPlayer = self.firstPlayer
-        self.highestCard = 0
-        self.highestCardOwner = None
-        self.lastMessage = None
-
-    async def __rearmCurrentTurn(self):
-        if DEBUG_ON:
-            self.currentTurn = 1
-        else:
-            self.currentTurn = self.nbOfTurns
-
-    async def __deleteLastMsg(self):
-        if self.lastMessage:
-            await self.lastMessage.delete()
-            self.lastMessage = None
-
-    async def setPlayerCall(self, playerName, call):
-        player = await self.__getPlayerByName(playerName)
-        player.call = int(call)
-
-    async def incrementPlayerFoldTaken(self, playerName):
-        player = await self.__getPlayerByName(playerName)
-        player.foldTaken += 1
-
-    async def isThisPlayerTurnToPlay(self, name):
-        return await self.__getPlayerPosition(name) == self.currentPlayer
+    def __init__(self, seed=None, journal=None):
+        self.state = TableState(seed)
+        self.hands = {}
+        self.bots = set()
+        self.board = StatusBoard()
+        self.lastAction = None
+        self.journal = journal
+        self.seed = seed
+        self.history = []  # records of the game, archived when it ends
+        self.recorder = None
+        self.onGameOver = None  # called with the final view, see tournament.py
+
+    @property
+    def players(self):
+        return self.state.players
+
+    async def __updateBoard(self, ctx, content):
+        self.board.update(ctx, content._replace(footer=self.lastAction))
+
+    async def __sendToChannel(self, ctx, content):
+        return await dispatcher.call(channelRoute(ctx.message.channel), ctx.send, embed=buildEmbed(content))
+
+    async def run(self, ctx, action, **extra):
+        self.state, events = apply(self.state, action)
+        if self.journal:
+            record = toRecord(action, events, **extra)
+            self.history.append(record)
+            self.journal.append(record)
+            if self.recorder is None and self.seed is not None:
+                self.recorder = GameRecorder(columnWriter, getGameId(self.seed), ctx.guild.id if ctx.guild else None)
+        handsChanged = False
+        for event in events:
+            if self.recorder:
+                self.recorder.onEvent(event)
+            await self.render(ctx, event)
+            handsChanged = handsChanged or event.type in (EventType.NEW_TURN, EventType.NEW_FOLD)
+        if handsChanged:
+            await self.sendCardsToPlayer()
+
+    async def render(self, ctx, event):
+        view = event.view
+        if event.type == EventType.PLAYER_JOINED:
+            await sendSimpleMessage(ctx, event.name + " a rejoint la partie. Vous êtes " + str(len(view.players)),
+                                    description=', '.join(player.name for player in view.players))
+        elif event.type == EventType.ALREADY_JOINED:
+            await sendSimpleMessage(ctx, "T'es déjà inscrit " + event.name, color='red')
+        elif event.type == EventType.TABLE_FULL:
+            await sendSimpleMessage(ctx, "Il y a déjà trop de joueurs !",
+                                    color='red',
+                                    description="maximum : " + str(len(view.players)))
+        elif event.type == EventType.NOT_ENOUGH_PLAYERS:
+            await sendSimpleMessage(ctx, "Pas assez de joueurs",
+                                    color='red',
+                                    description="minimum : " + str(MIN_PLAYER))
+        elif event.type == EventType.PLAYERS_ORDERED:
+            await self.printPlayersOrder(ctx, view)
+        elif event.type == EventType.NEW_TURN:
+            self.lastAction = None
+            await self.__updateBoard(ctx, initNewTurnMsg(view))
+        elif event.type == EventType.CALL_MADE:
+            self.lastAction = event.name + " call : " + str(event.call)
+            if view.turnState == TurnState.CALLING:
+                await self.__updateBoard(ctx, initCallingSummary(view, getNextCallerField(view)))
+        elif event.type == EventType.CALL_REFUSED:
+            await sendSimpleMessage(ctx, "Hé non ! Tu peux pas call " + str(event.call),
+                                    color='red',
+                                    description=getNbOfCallsString(view))
+        elif event.type == EventType.CALLING_OVER:
+            if view.currentTurn != 0:  # the last turn is played right away
+                await self.__updateBoard(ctx, initCallingSummary(view, getFirstPlayerField(view)))
+        elif event.type == EventType.LAST_TURN:
+            self.lastAction = None
+            await self.__updateBoard(ctx, initLastTurnMsg(view))
+            await self.board.detach()
+        elif event.type == EventType.CARD_PLAYED:
+            self.lastAction = event.name + " joue : " + str(event.card)
+            if not event.foldOver:
+                await self.__updateBoard(ctx, initPlayingSummary(view, getNextPlayerField(view)))
+        elif event.type == EventType.MISSING_CARD:
+            await sendSimpleMessage(ctx, "Tu n'as pas cette carte ...", color='red')
+        elif event.type == EventType.FOLD_WON:
+            await self.__updateBoard(ctx, initPlayingSummary(view))
+            await self.board.detach()  # keeps the fold result in the channel
+        elif event.type == EventType.NEW_FOLD:
+            await self.__updateBoard(ctx, initFoldSummary(view, getFirstPlayerField(view)))
+        elif event.type == EventType.TURN_SCORED:
+            await self.__sendToChannel(ctx, initShitPointsMsg(view))
+        elif event.type == EventType.DEALER_CHANGED:
+            await sendSimpleMessage(ctx, "Le nouveau dealer est " + event.name)
+            await self.printPlayersOrder(ctx, view)
+        elif event.type == EventType.GAME_OVER:
+            await self.__sendToChannel(ctx, initGameOverMsg(view))
+            leaderboard.record(ctx.guild.id if ctx.guild else None, ctx.message.channel.id,
+                               getResults(view, self.bots), len(view.players))
+            if self.journal:
+                archive.append({'seed': self.seed, 'guild': ctx.guild.id if ctx.guild else None,
+                                'channel': ctx.message.channel.id, 'endedAt': time.time(), 'records': self.history})
+            if self.onGameOver:
+                self.onGameOver(view)
 
     async def isThisPlayerMaster(self, name):
-        player = await self.__getPlayerByName(name)
-        if player:
-            return player.isMaster
-        else:
-            return False
+        return self.state.isThisPlayerMaster(name)
 
-    async def getPlayerList(self):
-        playerList = []
-        for player in self.players:
-            playerList.append(player.name)
-        return playerList
-
-    async def printPlayersOrder(self, ctx):
-        playerList = await self.getPlayerList()
-        await sendSimpleMessage(ctx, "Ordre des joueurs", description=', '.join(playerList))
+    async def printPlayersOrder(self, ctx, view):
+        await sendSimpleMessage(ctx, "Ordre des joueurs", description=', '.join(player.name for player in view.players))
 
     async def printPlayersInfo(self, ctx):
         for player in self.players:
@@ -190,252 +251,110 @@ class GameContext:
             cprint(player.name + ":")
             cprint(player.cards)
 
-    async def isThisANewPlayer(self, playerName, ctx):
-        for player in self.players:
-            if playerName == player.name:
-                await sendSimpleMessage(ctx, "T'es déjà inscrit " + playerName, color='red')
-                return False
-        return True
+    async def addPlayer(self, ctx, user=None):
+        user = user or ctx.message.author
+        await self.run(ctx, Join(user.name), user=user.id)
+        if user.name not in self.hands and self.state.getPlayerByName(user.name):
+            self.hands[user.name] = HandMessage(user)
+
+    async def addBot(self, ctx):
+        number = len(self.bots) + 1
+        while self.state.getPlayerByName("Bot " + str(number)):
+            number += 1
+        name = "Bot " + str(number)
+        await self.run(ctx, Join(name), bot=True)
+        if self.state.getPlayerByName(name):
+            self.bots.add(name)
+
+    def dump(self):
+        return {
+            'state': self.state.toDict(),
+            'bots': sorted(self.bots),
+            'users': {name: hand.user.id for name, hand in self.hands.items()},
+            'seed': self.seed,
+            'history': self.history,
+        }
+
+    def restore(self, data, users):
+        self.state = TableState.fromDict(data['state'])
+        self.bots = set(data['bots'])
+        self.seed = data.get('seed')
+        self.history = data.get('history', [])
+        self.hands = {name: HandMessage(users[userId]) for name, userId in data['users'].items() if users.get(userId)}
+
+    # Applies a journaled action without rendering anything
+    def replay(self, record, user=None):
+        self.state, events = apply(self.state, toAction(record))
+        self.history.append(record)
+        if self.state.getPlayerByName(record.get('name')):
+            if record.get('bot'):
+                self.bots.add(record['name'])
+            elif user and record['t'] == 'join':
+                self.hands[record['name']] = HandMessage(user)
+
+    async def chooseAction(self, name):
+        if self.state.turnState == TurnState.CALLING:
+            return await chooseCall(self.state, name)
+        return choosePlay(self.state, name)
+
+    # Bot seats play as long as it's their turn
+    async def runBots(self, ctx):
+        while self.state.turnState in (TurnState.CALLING, TurnState.PLAYING):
+            name = self.state.seatAt(self.state.currentPlayer).name
+            if name not in self.bots:
+                return
+            await self.run(ctx, await self.chooseAction(name))
+
+    # Plays for the current player when their turn timed out
+    async def autoPlay(self, ctx):
+        if self.state.turnState not in (TurnState.CALLING, TurnState.PLAYING):
+            return
+        name = self.state.seatAt(self.state.currentPlayer).name
+        await sendSimpleMessage(ctx, name + " est AFK, un bot joue à sa place", color='red')
+        await self.run(ctx, await self.chooseAction(name))
+        await self.runBots(ctx)
+
+    async def startGame(self, ctx):
+        await self.run(ctx, Go())
+        await self.runBots(ctx)
 
-    async def doesHeHaveThatCard(self, playerName, card):
-        player = await self.__getPlayerByName(playerName)
-        return int(await getActualCard(card)) in player.cards
+    async def handlePlayerCall(self, ctx, call):
+        await self.run(ctx, Call(ctx.message.author.name, call))
+        await self.runBots(ctx)
 
-    async def removeCardFromPlayer(self, playerName, card):
-        player = await self.__getPlayerByName(playerName)
-        player.cards.remove(int(await getActualCard(card)))
-        player.cardPlayed = str(card)
+    async def handleCardPlayed(self, ctx, playerName, card):
+        await self.run(ctx, Play(playerName, card))
+        await self.runBots(ctx)
 
-    async def addPlayer(self, ctx):
+    async def sendHint(self, ctx):
         name = ctx.message.author.name
-        if await self.isThisANewPlayer(name, ctx):
-            if len(self.players) <= MAX_PLAYER:
-                player = Player(name, bool(not self.players), ctx.message.author)
-                self.players.append(player)
-                await sendSimpleMessage(ctx, name + " a rejoint la partie. Vous êtes " + str(len(self.players)),
-                                        description=', '.join(await self.getPlayerList()))
-            else:
-                await sendSimpleMessage(ctx, "Il y a déjà trop de joueurs !",
-                                        color='red',
-                                        description="maximum : " + str(len(self.players)))
-
-    async def shuffleDeck(self, nbOfCards):
-        await self.deck.shuffle(nbOfCards)
-        dprint("Cards shuffled")
-        dprint(self.deck.cards)
-
-    async def dealCards(self):
-        if self.currentTurn == 0:
-            nbOfCards = 1  # Deal 1 card for turn 0 (last turn)
-            await self.shuffleDeck(21)  # No joker (22) on last turn
-        else:
-            nbOfCards = self.currentTurn
-            await self.shuffleDeck(22)
-        for cardsToDeal in range(nbOfCards):
-            for player in self.players:
-                player.cards.append(self.deck.cards.pop())
-
-    async def prepareGame(self, ctx):
-        self.nbOfTurns = 22 // len(self.players)
-        await self.__rearmCurrentTurn()
-        shuffle(self.players)
-        await self.printPlayersOrder(ctx)
-        self.currentPlayer = 0
-        self.firstPlayer = 0
-        self.firstDealer = self.players[0]
+        if name not in self.hands or self.state.turnState != TurnState.CALLING:
+            return  # the estimate is for a full hand, before the first fold
+        estimate = await probabilityEngine.estimateAsync(getSituation(self.state, name))
+        call = adviseCall(estimate, getAllowedCalls(self.state, name))
+        await sendMsgToPlayer(HINT.render("Plis attendus : " + "%.1f" % estimate.expectedFolds[call]
+                                          + "\nCall conseillé : " + str(call)), self.hands[name].user)
 
     async def sendCardsToPlayer(self):
-        if self.currentTurn == 0:
-            for receiver in self.players:
-                message = []
-                for otherPlayers in self.players:
-                    if receiver.name != otherPlayers.name:
-                        message.append(otherPlayers.name)
-                        message.append(str(otherPlayers.cards[0]))
-                await sendMsgToPlayer("Cartes sur le front des autres :", receiver.user, description=', '.join(message))
+        if self.state.currentTurn == 0:
+            front = [player.name + ', ' + str(player.cards[0]) for player in self.players]
+            contents = [FRONT_CARDS.render(', '.join(front[:position] + front[position + 1:]))
+                        for position in range(len(self.players))]
         else:
-            for receiver in self.players:
-                message = ['J' if card == 22 else str(card) for card in receiver.cards]
-                await sendMsgToPlayer("Vos cartes :", receiver.user, description=', '.join(message))
-
-    async def getNbOfCallsString(self):
-        return "Nombre de call : " + str(self.sumOfCalls) + "/" + str(self.maxNbOfCalls)
-
-    async def addNextCallerField(self, embedMsg):
-        embedMsg.add_field(name="Prochain caller (!call x) :", value=self.players[self.currentPlayer].name, inline=False)
-
-    async def addNextPlayerField(self, embedMsg):
-        embedMsg.add_field(name="Prochain joueur (!play x) :", value=self.players[self.currentPlayer].name, inline=False)
-
-    async def addFirstPlayerField(self, embedMsg):
-        embedMsg.add_field(name="Premier joueur du tour (!play x) :", value=self.players[self.currentPlayer].name, inline=False)
-
-    async def sendNewTurnMsg(self, ctx):
-        embedMsg = await initEmbedHeader("Nouveau tour :",
-                                         color='teal',
-                                         description=await self.getNbOfCallsString())
-        await self.addNextCallerField(embedMsg)
-        await ctx.send(embed=embedMsg)
-
-    async def startNewTurn(self, ctx):
-        await self.dealCards()
-        await self.sendCardsToPlayer()
-        await self.__startCallingPhase()
-        await self.sendNewTurnMsg(ctx)
-
-    async def handleLastTurn(self, ctx):
-        await sendSimpleMessage(ctx, "Dernier tour, allez on pose les cartes")
-        for player in range(len(self.players)):
-            await self.handleCardPlayed(ctx,
-                                        self.players[self.currentPlayer].name,
-                                        self.players[self.currentPlayer].cards[0])
-
-    async def initCallingSummary(self):
-        embedMsg = await initEmbedHeader("Résumé des calls :", description=await self.getNbOfCallsString())
-        for caller in self.players:
-            embedMsg.add_field(name=caller.name, value=str(caller.call))
-        return embedMsg
-
-    async def sendCallingPhaseMsg(self, ctx):
-        embedMsg = await self.initCallingSummary()
-        await self.addNextCallerField(embedMsg)
-        return await ctx.send(embed=embedMsg)
-
-    async def sendStartPlayingPhaseMsg(self, ctx):
-        embedMsg = await self.initCallingSummary()
-        await self.addFirstPlayerField(embedMsg)
-        return await ctx.send(embed=embedMsg)
-
-    async def nextPlayerCall(self, ctx):
-        self.currentPlayer += 1
-        if self.currentPlayer == len(self.players):
-            await self.__deleteLastMsg()
-            await self.__startPlayingPhase()
-            await self.sendStartPlayingPhaseMsg(ctx)
-            if self.currentTurn == 0:  # plays cards automatically on last turn since player don't know their cards
-                await self.handleLastTurn(ctx)
+            contents = [HAND.render(', '.join(['J' if card == JOKER else str(card) for card in receiver.cards]))
+                        for receiver in self.players]
+        await asyncio.gather(*[self.updatePlayerHand(self.hands[receiver.name], content)
+                               for content, receiver in zip(contents, self.players)
+                               if receiver.name in self.hands])  # bots have no DM
+
+    async def updatePlayerHand(self, hand, content):
+        if hand.content == content:
+            return
+        if hand.message:
+            try:
+                hand.message = await editMsgToPlayer(hand.message, content, hand.user)
+            except discord.NotFound:  # DM deleted by the player
+                hand.message = await sendMsgToPlayer(content, hand.user)
         else:
-            await self.__deleteLastMsg()
-            self.lastMessage = await self.sendCallingPhaseMsg(ctx)
-
-    async def handlePlayerCall(self, ctx, call):
-        if self.turnState == TurnState.CALLING and await self.isThisPlayerTurnToPlay(ctx.message.author.name):
-            if self.currentPlayer == len(self.players) - 1 and self.sumOfCalls + int(call) == self.maxNbOfCalls:
-                await sendSimpleMessage(ctx, "Hé non ! Tu peux pas call " + str(call),
-                                        color='red',
-                                        description=await self.getNbOfCallsString())
-            else:
-                await self.setPlayerCall(ctx.message.author.name, call)
-                self.sumOfCalls += int(call)
-                await sendSimpleMessage(ctx, ctx.message.author.name + " call : " + str(call))
-                await self.nextPlayerCall(ctx)
-
-    async def addShitPointsField(self, embedMsg):
-        for player in self.players:
-            embedMsg.add_field(name=player.name,
-                               value="+" + str(abs(player.call - player.foldTaken)) + " (" + str(player.shitPoints) + ")")
-
-    async def addFinalShitPointsField(self, embedMsg):
-        for player in self.players:
-            embedMsg.add_field(name=player.name,
-                               value=str(player.shitPoints))
-
-    async def sendShitPointsMsg(self, ctx):
-        embedMsg = await initEmbedHeader("Distrubution des shit points :")
-        await self.addShitPointsField(embedMsg)
-        return await ctx.send(embed=embedMsg)
-
-    async def computeShitPoints(self, ctx):
-        for player in self.players:
-            if player.call != player.foldTaken:
-                player.shitPoints += abs(player.call - player.foldTaken)
-        await self.sendShitPointsMsg(ctx)
-
-    async def sendEndOfGameMsg(self, ctx):
-        embedMsg = await initEmbedHeader("PARTIE FINIE !", description="scores finaux :", color='red')
-        await self.addFinalShitPointsField(embedMsg)
-        await ctx.send(embed=embedMsg)
-
-    async def nextDealer(self, ctx):
-        if self.players[1] == self.firstDealer:
-            await self.sendEndOfGameMsg(ctx)
-            self.turnState = TurnState.PLAYING_OVER
-        else:
-            currentDealer = self.players[0]  # Current dealer is self.players[0]
-            for player in range(len(self.players) - 1):
-                self.players[player] = self.players[player + 1]
-            self.players[len(self.players) - 1] = currentDealer
-            await sendSimpleMessage(ctx, "Le nouveau dealer est " + self.players[0].name)
-            await self.printPlayersOrder(ctx)
-            await self.__rearmCurrentTurn()
-            await self.startNewTurn(ctx)
-
-    async def incrementCurrentPlayer(self):
-        self.currentPlayer += 1
-        if self.currentPlayer == len(self.players):  #
-            self.currentPlayer = 0
-
-    async def initPlayingSummary(self):
-        embedMsg = await initEmbedHeader("Cartes jouées :",
-                                         description="C'est " + self.highestCardOwner + " qui a la main avec " + str(self.highestCard))
-        for player in self.players:
-            embedMsg.add_field(name=player.name, value=str(player.cardPlayed))
-        return embedMsg
-
-    async def sendPlayingPhaseMsg(self, ctx, printNextPlayer=True):
-        embedMsg = await self.initPlayingSummary()
-        if printNextPlayer:
-            await self.addNextPlayerField(embedMsg)
-        return await ctx.send(embed=embedMsg)
-
-    async def initFoldSummary(self):
-        embedMsg = await initEmbedHeader("Résumé des plis :")
-        for player in self.players:
-            embedMsg.add_field(name=player.name, value=str(player.foldTaken) + "/" + str(player.call))
-        return embedMsg
-
-    async def sendEndOfFoldMsg(self, ctx):
-        embedMsg = await self.initFoldSummary()
-        await self.addFirstPlayerField(embedMsg)
-        return await ctx.send(embed=embedMsg)
-
-    async def nextPlayer(self, ctx):
-        await self.incrementCurrentPlayer()
-        if self.currentPlayer == self.firstPlayer:  # Fold is over
-            await self.__deleteLastMsg()
-            await self.sendPlayingPhaseMsg(ctx, printNextPlayer=False)
-            await self.incrementPlayerFoldTaken(self.highestCardOwner)
-            self.highestCard = 0
-            if self.players[self.currentPlayer].cards:  # New fold
-                await self.sendCardsToPlayer()
-                self.firstPlayer = await self.__getPlayerPosition(self.highestCardOwner)
-                self.currentPlayer = self.firstPlayer
-                await self.sendEndOfFoldMsg(ctx)
-            else:  # Turn is over
-                await self.computeShitPoints(ctx)
-                self.currentTurn -= 1
-                if self.currentTurn >= 0:
-                    await self.startNewTurn(ctx)
-                else:
-                    await self.nextDealer(ctx)
-            for player in self.players:
-                player.cardPlayed = "NA"
-        else:  # There are still player playing this fold
-            if self.currentTurn != 0:
-                await self.__deleteLastMsg()
-                self.lastMessage = await self.sendPlayingPhaseMsg(ctx)
-
-    async def checkIfCardIsHigher(self, card, playerName):
-        if int(card) > self.highestCard:
-            self.highestCard = int(card)
-            self.highestCardOwner = playerName
-
-    async def handleCardPlayed(self, ctx, playerName, card):
-        if self.turnState == TurnState.PLAYING and await self.isThisPlayerTurnToPlay(playerName):
-            if await self.doesHeHaveThatCard(playerName, card):
-                await self.removeCardFromPlayer(playerName, card)
-                await self.checkIfCardIsHigher(card, playerName)
-                await sendSimpleMessage(ctx, playerName + " joue : " + str(card))
-                await self.nextPlayer(ctx)
-            else:
-                await sendSimpleMessage(ctx, "Tu n'as pas cette carte ...", color='red')
+            hand.message = await sendMsgToPlayer(content, hand.user)
+        hand.content = content
@@ -6,8 +6,11 @@ from dotenv import load_dotenv
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
-bot = commands.Bot(command_prefix='!')
+# The table workers (TARAF_WORKERS) import this module again, they must not
+# start a bot of their own
+if __name__ == '__main__':
+    bot = commands.Bot(command_prefix='!')
 
-bot.add_cog(TarCog(bot))
+    bot.add_cog(TarCog(bot))
 
-bot.run(TOKEN)
+    bot.run(TOKEN)
@@ -1,91 +1,198 @@
-from enum import Enum
+import discord
 from discord.ext import commands
-from taraf import GameContext, dprint, MIN_PLAYER, sendSimpleMessage
+from taraf import dprint, sendSimpleMessage, initLeaderboard, initPlayerStats, initPerfMsg, initProfileMsg, initStandingsMsg
+from metrics import metrics
+from render import buildEmbed
+from dispatcher import dispatcher, channelRoute
+from leaderboard import leaderboard
+from tables import TableRegistry
+from workers import WORKERS, RemoteRegistry
+from engine import MIN_PLAYER
+from tournament import Tournament, TournamentState, DEFAULT_ROUNDS, MAX_ROUNDS
 
 
-class GameState(Enum):
-    NOT_STARTED = 1
-    SIGNIN = 2
-    STARTED = 3
+# Command messages are deleted through the dispatcher too, a 429 on them would
+# otherwise fail the command
+async def deleteCommand(ctx):
+    await dispatcher.call(channelRoute(ctx.message.channel), ctx.message.delete)
 
 
 class TarCog(commands.Cog):
     def __init__(self, bot):
-        self.state = GameState.NOT_STARTED
-        self.theGame = GameContext()
-        self.channel = None
+        self.tables = RemoteRegistry(WORKERS) if WORKERS else TableRegistry()
+        self.tournaments = {}
         self.bot = bot
+        self.recovered = False
+        print("Bot running")
+
+    # Tables that were open when the bot stopped are rebuilt from their journal
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.recovered:
+            self.recovered = True
+            await self.tables.recover(self.getUser)
+            print(str(len(self.tables)) + " table(s) restaurée(s)")
+            await metrics.start()
+
+    async def getUser(self, userId):
+        user = self.bot.get_user(userId)
+        if user is None:
+            try:
+                user = await self.bot.fetch_user(userId)
+            except discord.HTTPException:
+                dprint("Utilisateur introuvable : " + str(userId))
+        return user
 
     @commands.command()
     async def start(self, ctx):
         dprint("!start")
-        if self.state == GameState.NOT_STARTED:
-            self.state = GameState.SIGNIN
-            self.channel = ctx.message.channel.name
-            await sendSimpleMessage(ctx, "!join pour rejoindre")
-        else:
-            await sendSimpleMessage(ctx, "Partie déjà en cours", color='red')
+        table = self.tables.getOrOpen(ctx)
+        await table.submit(table.start, ctx)
 
     @commands.command()
     async def stop(self, ctx):
-        if self.channel == ctx.message.channel.name:
-            if await self.theGame.isThisPlayerMaster(ctx.message.author.name):
-                dprint("!stop")
-                self.theGame = GameContext()
-                self.state = GameState.NOT_STARTED
-                await sendSimpleMessage(ctx, "La partie a été reset")
-        await ctx.message.delete()
+        table = self.tables.get(ctx)
+        if table:
+            await table.submit(table.stop, ctx)
+        await deleteCommand(ctx)
 
     @commands.command()
     async def join(self, ctx):
-        if self.channel == ctx.message.channel.name:
+        table = self.tables.get(ctx)
+        if table:
             dprint("!join")
-            if self.state == GameState.SIGNIN:
-                await self.theGame.addPlayer(ctx)
-            else:
-                await sendSimpleMessage(ctx, "Pas possible de rejoindre", color='red')
+            await table.submit(table.join, ctx)
+
+    @commands.command(name='bot')  # self.bot is the discord bot
+    async def addBot(self, ctx):
+        table = self.tables.get(ctx)
+        if table:
+            dprint("!bot")
+            await table.submit(table.bot, ctx)
 
     @commands.command()
     async def go(self, ctx):
-        if self.channel == ctx.message.channel.name:
+        table = self.tables.get(ctx)
+        if table:
             dprint("!go")
-            if self.state == GameState.SIGNIN:
-                if len(self.theGame.players) >= MIN_PLAYER:
-                    self.state = GameState.STARTED
-                    await self.theGame.prepareGame(ctx)
-                    await self.theGame.startNewTurn(ctx)
-                else:
-                    await sendSimpleMessage(ctx, "Pas assez de joueurs",
-                                            color='red',
-                                            description="minimum : " + str(MIN_PLAYER))
-            else:
-                await sendSimpleMessage(ctx, "Il faut d'abord ouvrir les inscriptions")
+            await table.submit(table.go, ctx)
 
     @commands.command()
     async def call(self, ctx, call):
-        if self.channel == ctx.message.channel.name:
+        table = self.tables.get(ctx)
+        if table:
             dprint("!call " + str(call))
-            if self.state == GameState.STARTED:
-                await self.theGame.handlePlayerCall(ctx, call)
-        await ctx.message.delete()
+            await table.submit(table.call, ctx, call)
+        await deleteCommand(ctx)
 
     @commands.command()
     async def play(self, ctx, card):
-        if self.channel == ctx.message.channel.name:
+        table = self.tables.get(ctx)
+        if table:
             dprint("!play " + str(card))
-            if self.state == GameState.STARTED:
-                if card == "J+":
-                    card = 22
-                elif card == "J-":
-                    card = 0
-                await self.theGame.handleCardPlayed(ctx, ctx.message.author.name, card)
-        await ctx.message.delete()
+            if card == "J+":
+                card = 22
+            elif card == "J-":
+                card = 0
+            await table.submit(table.play, ctx, card)
+        await deleteCommand(ctx)
+
+    @commands.command()
+    async def hint(self, ctx):
+        table = self.tables.get(ctx)
+        if table:
+            await table.submit(table.theGame.sendHint, ctx)
+        await deleteCommand(ctx)
+
+    @commands.command(name='leaderboard')
+    async def showLeaderboard(self, ctx):
+        rows = await leaderboard.getLeaderboard(ctx.guild.id if ctx.guild else None)
+        if rows:
+            await dispatcher.call(channelRoute(ctx.message.channel), ctx.send, embed=buildEmbed(initLeaderboard(rows)))
+        else:
+            await sendSimpleMessage(ctx, "Aucune partie terminée pour l'instant")
+
+    @commands.command()
+    async def stats(self, ctx, *, player=None):
+        player = player or ctx.message.author.name
+        stats = await leaderboard.getStats(ctx.guild.id if ctx.guild else None, player)
+        if stats:
+            await dispatcher.call(channelRoute(ctx.message.channel), ctx.send, embed=buildEmbed(initPlayerStats(stats)))
+        else:
+            await sendSimpleMessage(ctx, "Aucune partie terminée pour " + player, color='red')
+
+    # !tournament to open the registrations in this channel, then !tournament join,
+    # !tournament start [manches], !tournament standings and !tournament stop
+    @commands.command()
+    async def tournament(self, ctx, action=None, rounds=None):
+        if ctx.guild is None:
+            await sendSimpleMessage(ctx, "Les tournois se jouent sur un serveur", color='red')
+            return
+        key = self.tables.getKey(ctx)
+        tournament = self.tournaments.get(key)
+        if tournament and tournament.state == TournamentState.FINISHED:
+            tournament = self.tournaments.pop(key)
+        isOrganiser = tournament and tournament.organiser.id == ctx.message.author.id
+        if action is None or action == 'open':
+            if tournament:
+                await sendSimpleMessage(ctx, "Tournoi déjà en cours", color='red')
+            else:
+                self.tournaments[key] = tournament = Tournament(self.tables, ctx)
+                tournament.register(ctx.message.author)
+                await sendSimpleMessage(ctx, "Tournoi ouvert", description="!tournament join pour s'inscrire")
+        elif tournament is None:
+            await sendSimpleMessage(ctx, "Pas de tournoi ici, !tournament pour en ouvrir un", color='red')
+        elif action == 'join':
+            if tournament.register(ctx.message.author):
+                await sendSimpleMessage(ctx, ctx.message.author.name + " est inscrit(e) ("
+                                        + str(len(tournament.users)) + " joueurs)")
+            else:
+                await sendSimpleMessage(ctx, "Pas possible de s'inscrire", color='red')
+        elif action == 'standings':
+            await dispatcher.call(channelRoute(ctx.message.channel), ctx.send,
+                                  embed=buildEmbed(initStandingsMsg("Classement du tournoi :", tournament.getStandings())))
+        elif not isOrganiser:
+            await sendSimpleMessage(ctx, "Seul l'organisateur peut faire ça", color='red')
+        elif action == 'start':
+            rounds = int(rounds) if rounds and rounds.isdigit() else DEFAULT_ROUNDS
+            if tournament.state != TournamentState.REGISTRATION:
+                await sendSimpleMessage(ctx, "Tournoi déjà commencé", color='red')
+            elif len(tournament.users) < MIN_PLAYER or not 1 <= rounds <= MAX_ROUNDS:
+                await sendSimpleMessage(ctx, "Il faut au moins " + str(MIN_PLAYER) + " joueurs et de 1 à "
+                                        + str(MAX_ROUNDS) + " manches", color='red')
+            else:
+                tournament.start(rounds)
+        elif action == 'stop':
+            self.tournaments.pop(key)
+            await tournament.stop()
+            await sendSimpleMessage(ctx, "Tournoi arrêté")
+
+    # !perf for the metrics, !perf profile to start the sampling profiler and
+    # again to stop it and get its report
+    @commands.command()
+    @commands.is_owner()
+    async def perf(self, ctx, action=None):
+        if action == 'profile':
+            if metrics.profiler.running:
+                metrics.profiler.stop()
+                content = initProfileMsg(metrics.profiler.report())
+            else:
+                metrics.profiler.start()
+                await sendSimpleMessage(ctx, "Profileur démarré", description="!perf profile pour l'arrêter")
+                return
+        else:
+            content = initPerfMsg(metrics)
+        await dispatcher.call(channelRoute(ctx.message.channel), ctx.send, embed=buildEmbed(content))
 
     # for debug
     @commands.command()
     async def show(self, ctx):
-        await self.theGame.printPlayersInfo(ctx)
+        table = self.tables.get(ctx)
+        if table:
+            await table.submit(table.theGame.printPlayersInfo, ctx)
 
     @commands.command()
     async def cheat(self, ctx):
-        await self.theGame.printPlayersCards()
+        table = self.tables.get(ctx)
+        if table:
+            await table.submit(table.theGame.printPlayersCards)
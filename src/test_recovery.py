@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Tables rebuilt from their journal (snapshots included) after a crash at a
+# random point of a seeded game must be the tables that were running, and go
+# on the same way. Bad commands (wrong player, refused calls) are mixed in so
+# a rule change that would journal them differently is caught.
+#
+# python -m pytest test_recovery.py
+
+import asyncio
+import json
+from random import Random
+import board
+import dispatcher
+import journal
+import leaderboard
+import taraf
+from advisor import getAllowedCalls, choosePlay
+from analytics import columnWriter
+from engine import TurnState
+from loadtest import UNLIMITED, FakeApi, FakeChannel, FakeContext, FakeGuild, FakeUser
+from tables import TableRegistry
+
+GAMES = 10
+
+
+def getState(table):
+    return table.state, json.dumps(table.theGame.state.toDict(), sort_keys=True), sorted(table.theGame.bots)
+
+
+# One command of a random player, usually the one whose turn it is
+async def playOnce(table, contexts, rng):
+    state = table.theGame.state
+    name = state.seatAt(state.currentPlayer).name
+    if rng.random() < 0.1:
+        name = rng.choice(list(contexts))
+    ctx = contexts[name]
+    if state.turnState == TurnState.CALLING:
+        calls = getAllowedCalls(state, name)
+        call = rng.choice(calls + [state.maxNbOfCalls + 1, 300, -1]) if rng.random() < 0.2 else rng.choice(calls)
+        await table.submit(table.call, ctx, str(call))
+    else:
+        await table.submit(table.play, ctx, choosePlay(state, state.seatAt(state.currentPlayer).name).card)
+
+
+def isPlaying(table):
+    return table.theGame.state.turnState in (TurnState.CALLING, TurnState.PLAYING)
+
+
+async def playCutAndRecover(directory, seed):
+    rng = Random(seed)
+    api = FakeApi()
+    guild = FakeGuild()
+    channel = FakeChannel(api, "table")
+    users = [FakeUser(api, "joueur " + str(seat)) for seat in range(rng.randint(2, 5))]
+    contexts = {user.name: FakeContext(api, guild, channel, user) for user in users}
+    master = contexts[users[0].name]
+
+    registry = TableRegistry(directory)
+    table = registry.getOrOpen(master)
+    await table.submit(table.start, master)
+    for ctx in contexts.values():
+        await table.submit(table.join, ctx)
+    if rng.random() < 0.5:
+        await table.submit(table.bot, master)
+    await table.submit(table.go, master)
+    for action in range(rng.randint(0, 300)):
+        if not isPlaying(table):
+            break
+        await playOnce(table, contexts, rng)
+    await table.journal.close()  # the crash, after the last fsync
+    table.attach(None)  # the table that was running goes on in memory
+    before = getState(table)
+
+    async def getUser(userId):
+        return next((user for user in users if user.id == userId), None)
+    recovered = TableRegistry(directory)
+    await recovered.recover(getUser)
+    restored = recovered.tables[table.key]
+    restored.touch(master)
+    assert getState(restored) == before
+
+    # both go on with the same commands
+    endings = []
+    for running in (table, restored):
+        commands = Random(seed + 1)
+        while isPlaying(running):
+            await playOnce(running, contexts, commands)
+        endings.append(getState(running))
+        running.close()
+    assert endings[0] == endings[1]
+
+
+def test_recovery(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, 'SNAPSHOT_EVERY', 25)
+    monkeypatch.setattr(board, 'COALESCE_DELAY', 0)
+    monkeypatch.setattr(dispatcher, 'ROUTE_RATE', UNLIMITED)
+    monkeypatch.setattr(dispatcher, 'ROUTE_BURST', UNLIMITED)
+    monkeypatch.setattr(dispatcher.dispatcher, 'globalBucket', dispatcher.TokenBucket(UNLIMITED, UNLIMITED))
+    monkeypatch.setattr(leaderboard.leaderboard, 'path', ':memory:')
+    monkeypatch.setattr(taraf.archive, 'directory', str(tmp_path / 'archives'))
+    monkeypatch.setattr(columnWriter, 'directory', str(tmp_path / 'stats'))
+
+    async def run():
+        for seed in range(GAMES):
+            await playCutAndRecover(str(tmp_path / 'journals'), seed)
+        await journal.journalWriter.flush()
+    asyncio.run(run())
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# The solver against a plain max^n search that tries every card, without the
+# transposition table nor the merged moves
+#
+# python -m pytest test_solver.py
+
+import json
+from random import Random
+from advisor import getAllowedCalls, choosePlay
+from engine import JOKER, TurnState, TableState, Join, Go, Call, apply, cardsOf, countCards
+from journal import toRecord
+from solver import Solver, analyseRound, dealHands, getArchivedRounds
+
+ROUNDS = 300
+
+
+def bruteForce(hands, needs, leader=0, offset=0, highest=0, owner=None):
+    nbOfPlayers = len(hands)
+    if offset == nbOfPlayers:
+        folds = [0] * nbOfPlayers
+        if hands[owner]:
+            needs = list(needs)
+            needs[owner] -= 1
+            folds = list(bruteForce(hands, needs, owner))
+        folds[owner] += 1
+        return tuple(folds)
+    position = (leader + offset) % nbOfPlayers
+    best = None
+    for card in cardsOf(hands[position]):
+        for value in ((JOKER, 0) if card == JOKER else (card,)):
+            nextHands = list(hands)
+            nextHands[position] &= ~(1 << card)
+            if value > highest:
+                folds = bruteForce(nextHands, needs, leader, offset + 1, value, position)
+            else:
+                folds = bruteForce(nextHands, needs, leader, offset + 1, highest, owner)
+            if best is None or abs(needs[position] - folds[position]) < abs(needs[position] - best[position]):
+                best = folds
+    return best
+
+
+def getPenalties(calls, folds):
+    return [abs(call - taken) for call, taken in zip(calls, folds)]
+
+
+# Equal plays can give other players different folds, only the penalty of
+# each player is compared
+def test_solvePlayMatchesBruteForce():
+    rng = Random(5)
+    for round in range(ROUNDS):
+        nbOfPlayers = rng.randint(2, 4)
+        nbOfCards = rng.randint(1, 3)
+        hands = dealHands(rng, nbOfPlayers, nbOfCards)
+        calls = tuple(rng.randint(0, nbOfCards) for player in range(nbOfPlayers))
+        assert getPenalties(calls, Solver().solvePlay(hands, calls)) == \
+            getPenalties(calls, bruteForce(tuple(hands), calls)), (hands, calls)
+
+
+def test_analyseRound():
+    rng = Random(7)
+    hands = dealHands(rng, 3, 2)
+    calls = (1, 0, 0)
+    analysis = analyseRound(hands, calls)
+    assert sum(analysis['optimalFolds']) == 2
+    assert analysis['optimalPenalties'] == tuple(getPenalties(calls, analysis['optimalFolds']))
+    assert all(0 <= call <= 2 for call in analysis['bestResponseCalls'])
+
+
+# Rounds of an archived game, played with the advisor's first allowed call
+def test_getArchivedRounds(tmp_path):
+    state = TableState(11)
+    records = []
+    for action in [Join("a"), Join("b"), Join("c"), Go()]:
+        state, events = apply(state, action)
+        records.append(toRecord(action, events))
+    while state.turnState in (TurnState.CALLING, TurnState.PLAYING):
+        name = state.seatAt(state.currentPlayer).name
+        action = Call(name, getAllowedCalls(state, name)[0]) if state.turnState == TurnState.CALLING else \
+            choosePlay(state, name)
+        state, events = apply(state, action)
+        records.append(toRecord(action, events))
+    (tmp_path / 'games.jsonl').write_text(json.dumps({'seed': 11, 'records': records}) + '\n')
+    rounds = list(getArchivedRounds([str(tmp_path)], 2))
+    assert [nbOfCards for nbOfCards, hands, calls, folds in rounds] == [2, 1] * 3  # every dealer deals 7, 6 ... 1 cards
+    for nbOfCards, hands, calls, folds in rounds:
+        assert sum(folds) == nbOfCards and all(countCards(hand) == nbOfCards for hand in hands)
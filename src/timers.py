@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# Hashed timer wheel shared by every table: a single task ticks every TICK and
+# fires the timers of the current slot, instead of one sleeping task per timer.
+# Scheduling and cancelling are O(1), a timer further than one turn of the wheel
+# just waits for the right round.
+
+import asyncio
+import math
+
+TICK = 1.0
+WHEEL_SIZE = 512
+
+
+class Timer:
+    __slots__ = ('slot', 'rounds', 'callback', 'args')
+
+    def __init__(self, slot, rounds, callback, args):
+        self.slot = slot
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+
+
+class TimerWheel:
+    def __init__(self, tick=TICK, size=WHEEL_SIZE):
+        self.tick = tick
+        self.slots = [set() for slot in range(size)]
+        self.current = 0
+        self.task = None
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    # callback(*args) is called in about delay seconds (one tick late at worst),
+    # it can be a coroutine function
+    def schedule(self, delay, callback, *args):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.__run())
+        ticks = max(1, math.ceil(delay / self.tick))
+        rounds, offset = divmod(ticks, len(self.slots))
+        if offset == 0:
+            rounds, offset = rounds - 1, len(self.slots)
+        timer = Timer((self.current + offset) % len(self.slots), rounds, callback, args)
+        self.slots[timer.slot].add(timer)
+        return timer
+
+    def cancel(self, timer):
+        if timer:
+            self.slots[timer.slot].discard(timer)
+
+    async def __run(self):
+        loop = asyncio.get_event_loop()
+        nextTick = loop.time() + self.tick
+        while True:
+            await asyncio.sleep(max(0.0, nextTick - loop.time()))
+            nextTick += self.tick
+            self.current = (self.current + 1) % len(self.slots)
+            slot = self.slots[self.current]
+            for timer in list(slot):
+                if timer.rounds:
+                    timer.rounds -= 1
+                    continue
+                slot.discard(timer)
+                try:
+                    result = timer.callback(*timer.args)
+                except Exception as error:  # the other timers still fire
+                    printError(timer, error)
+                    continue
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(self.__await(timer, result))
+
+    @staticmethod
+    async def __await(timer, result):
+        try:
+            await result
+        except Exception as error:
+            printError(timer, error)
+
+
+def printError(timer, error):
+    print("Erreur du timer " + getattr(timer.callback, '__qualname__', repr(timer.callback)) + " : " + repr(error))
+
+
+timerWheel = TimerWheel()
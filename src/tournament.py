@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+# Tournaments: the registered players are seated at tables of MIN_PLAYER to
+# MAX_PLAYER players, each table playing in its own text channel and every table
+# at the same time. Between rounds players are reseated by cumulative shit
+# points, the best ones together. Standings are updated as soon as a table
+# finishes, not at the end of the round.
+
+import asyncio
+import math
+import random
+from collections import namedtuple
+from enum import Enum
+from dispatcher import dispatcher, channelRoute
+from engine import MAX_PLAYER, dprint
+from render import buildEmbed
+from taraf import sendSimpleMessage, initStandingsMsg
+
+DEFAULT_ROUNDS = 3
+MAX_ROUNDS = 10
+MAX_CONCURRENT_SETUPS = 4
+TABLE_CHANNEL = "tournoi-table-"
+
+
+class TournamentState(Enum):
+    REGISTRATION = 1
+    RUNNING = 2
+    FINISHED = 3
+
+
+class Standing:
+    __slots__ = ('name', 'shitPoints', 'games', 'wins')
+
+    def __init__(self, name):
+        self.name = name
+        self.shitPoints = 0
+        self.games = 0
+        self.wins = 0
+
+
+# Context of a table channel for what the tournament does there by itself
+TableMessage = namedtuple('TableMessage', ['channel', 'author'])
+
+
+class TableContext:
+    def __init__(self, channel, author):
+        self.guild = channel.guild
+        self.message = TableMessage(channel, author)
+
+    async def send(self, *args, **kwargs):
+        return await self.message.channel.send(*args, **kwargs)
+
+
+# Sizes of the tables for nbOfPlayers, as even as possible
+def getTableSizes(nbOfPlayers):
+    nbOfTables = math.ceil(nbOfPlayers / MAX_PLAYER)
+    size, extra = divmod(nbOfPlayers, nbOfTables)
+    return [size + 1] * extra + [size] * (nbOfTables - extra)
+
+
+# Opening a round sends the first messages and DMs of every table at once: the
+# scheduler lets only a few tables set up at a time, the dispatcher still
+# bounding the requests in flight of the games themselves
+class TableScheduler:
+    def __init__(self, maxConcurrent=MAX_CONCURRENT_SETUPS):
+        self.maxConcurrent = maxConcurrent
+        self.semaphore = None
+
+    async def run(self, job, *args):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.maxConcurrent)
+        async with self.semaphore:
+            return await job(*args)
+
+
+class Tournament:
+    def __init__(self, registry, ctx):
+        self.registry = registry
+        self.lobby = ctx
+        self.organiser = ctx.message.author
+        self.state = TournamentState.REGISTRATION
+        self.users = {}
+        self.standings = {}
+        self.nbOfRounds = DEFAULT_ROUNDS
+        self.round = 0
+        self.channels = []
+        self.scheduler = TableScheduler()
+        self.task = None
+
+    def register(self, user):
+        if self.state != TournamentState.REGISTRATION or user.name in self.users:
+            return False
+        self.users[user.name] = user
+        self.standings[user.name] = Standing(user.name)
+        return True
+
+    def getStandings(self):
+        return sorted(self.standings.values(), key=lambda standing: (standing.shitPoints, -standing.wins))
+
+    # Random seats for the first round, then by standings
+    def getSeatingOrder(self):
+        if self.round == 0:
+            names = list(self.users)
+            random.shuffle(names)
+            return names
+        return [standing.name for standing in self.getStandings()]
+
+    def start(self, nbOfRounds=DEFAULT_ROUNDS):
+        self.nbOfRounds = nbOfRounds
+        self.state = TournamentState.RUNNING
+        self.task = asyncio.ensure_future(self.__run())
+
+    async def __run(self):
+        try:
+            for self.round in range(self.nbOfRounds):
+                await self.__playRound()
+                await self.__sendStandings(("Classement final :" if self.round == self.nbOfRounds - 1 else
+                                            "Classement après la manche " + str(self.round + 1) + " :"))
+        except Exception as error:
+            print("Erreur du tournoi : " + repr(error))
+            await sendSimpleMessage(self.lobby, "Le tournoi s'est arrêté sur une erreur", color='red')
+        finally:
+            self.state = TournamentState.FINISHED
+            await self.__closeTables()
+
+    async def __playRound(self):
+        order = self.getSeatingOrder()
+        groups = []
+        for size in getTableSizes(len(order)):
+            groups.append([self.users[name] for name in order[:size]])
+            order = order[size:]
+        while len(self.channels) < len(groups):
+            self.channels.append(await self.__createChannel(len(self.channels) + 1))
+        await sendSimpleMessage(self.lobby, "Manche " + str(self.round + 1) + "/" + str(self.nbOfRounds),
+                                description='\n'.join(self.channels[number].mention + " : "
+                                                      + ', '.join(user.name for user in group)
+                                                      for number, group in enumerate(groups)))
+        loop = asyncio.get_event_loop()
+        finished = [loop.create_future() for group in groups]
+        await asyncio.gather(*[self.scheduler.run(self.__openTable, number, group, finished[number])
+                               for number, group in enumerate(groups)])
+        await asyncio.gather(*finished)
+
+    async def __createChannel(self, number):
+        guild = self.lobby.guild
+        return await dispatcher.call("guild:" + str(guild.id), guild.create_text_channel, TABLE_CHANNEL + str(number),
+                                     category=getattr(self.lobby.message.channel, 'category', None))
+
+    async def __openTable(self, number, users, finished):
+        ctx = TableContext(self.channels[number], self.organiser)
+        table = self.registry.getOrOpen(ctx)
+        table.tournament = self
+        await table.submit(table.seat, ctx, users, lambda view: self.__tableFinished(number, view, finished))
+
+    # Called by the table when its game is over
+    def __tableFinished(self, number, view, finished):
+        best = min(player.shitPoints for player in view.players)
+        for player in view.players:
+            standing = self.standings.get(player.name)
+            if standing:
+                standing.shitPoints += player.shitPoints
+                standing.games += 1
+                standing.wins += player.shitPoints == best
+        if not finished.done():
+            finished.set_result(view)
+        asyncio.ensure_future(self.__sendStandings("Table " + str(number + 1) + " terminée, classement provisoire :"))
+
+    async def __sendStandings(self, title):
+        await dispatcher.call(channelRoute(self.lobby.message.channel), self.lobby.send,
+                              embed=buildEmbed(initStandingsMsg(title, self.getStandings())))
+
+    async def stop(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+        else:
+            await self.__closeTables()
+
+    async def __closeTables(self):
+        channels, self.channels = self.channels, []
+        for channel in channels:
+            self.registry.close(self.registry.getKey(TableContext(channel, self.organiser)), removeJournal=True)
+            try:
+                await dispatcher.call("guild:" + str(channel.guild.id), channel.delete)
+            except Exception as error:
+                dprint("Salon non supprimé : " + repr(error))
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+# Tables in worker processes. With TARAF_WORKERS=n the bot process only keeps
+# the gateway connection and routes commands: the tables live in n worker
+# processes, each table in the worker given by its key, and the workers send
+# back the discord calls the games make (send, edit, delete), which the bot runs
+# through its dispatcher. A slow table only slows its worker, and a worker that
+# dies is started again and reopens its tables from their journals.
+
+import asyncio
+import itertools
+import multiprocessing
+import os
+import tempfile
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+import discord
+from dispatcher import dispatcher, channelRoute, dmRoute
+from engine import TurnState, PlayerView
+from ipc import MAX_LINE, Connection, RemoteError
+from journal import JOURNAL_DIR, getFileName, archive
+from leaderboard import leaderboard
+from analytics import columnWriter
+from metrics import METRICS_PORT, metrics
+from tables import TableRegistry
+
+WORKERS = int(os.getenv('TARAF_WORKERS', '0'))
+START_TIMEOUT = 30
+# Messages, channels and users the workers can refer to, the least recently
+# used are forgotten (a forgotten message is sent again instead of edited)
+MAX_CACHED = 65536
+
+# Commands a worker runs, see Table and GameContext
+COMMANDS = {'start', 'stop', 'join', 'bot', 'go', 'call', 'play', 'seat',
+            'theGame.sendHint', 'theGame.printPlayersInfo', 'theGame.printPlayersCards'}
+
+# What the bot gets back from a finished tournament table, see Tournament
+GameView = namedtuple('GameView', ['players'])
+
+# The workers import the bot modules again instead of inheriting its state
+CONTEXT = multiprocessing.get_context('spawn')
+
+
+def getWorkerIndex(key, nbOfWorkers):
+    return zlib.crc32(getFileName(key).encode()) % nbOfWorkers
+
+
+def remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > MAX_CACHED:
+        cache.popitem(last=False)
+
+
+class MissingMessage(Exception):
+    status = 404
+
+
+# Bot side
+
+# table.submit(table.join, ctx) on a RemoteTable sends 'join' to the worker
+class RemoteCommand:
+    def __init__(self, name):
+        self.__name__ = name
+
+
+class RemoteGame:
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return RemoteCommand('theGame.' + name)
+
+
+class RemoteTable:
+    def __init__(self, registry, key, ctx, canOpen):
+        self.registry = registry
+        self.key = key
+        self.ctx = ctx
+        self.canOpen = canOpen
+        self.tournament = None
+        self.theGame = RemoteGame()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return RemoteCommand(name)
+
+    # The latency includes the round trip to the worker
+    async def submit(self, command, *args):
+        start = time.perf_counter()
+        try:
+            return await self.registry.submit(self, command.__name__, args)
+        finally:
+            metrics.observeCommand(command.__name__, time.perf_counter() - start)
+
+
+# Same interface as TableRegistry for the cog and the tournaments. Whether a
+# table is open is only known by its worker, get() always returns a table and
+# the worker ignores the commands of a table it doesn't have.
+class RemoteRegistry:
+    getKey = staticmethod(TableRegistry.getKey)
+
+    def __init__(self, nbOfWorkers=WORKERS, directory=JOURNAL_DIR):
+        self.nbOfWorkers = nbOfWorkers
+        self.directory = directory
+        self.workers = [None] * nbOfWorkers
+        self.processes = [None] * nbOfWorkers
+        self.ready = [None] * nbOfWorkers
+        self.counts = [0] * nbOfWorkers
+        self.channels = OrderedDict()
+        self.users = OrderedDict()
+        self.messages = OrderedDict()
+        self.handles = itertools.count(1)
+        self.callbacks = {}
+        self.getUser = None
+        self.path = None
+        self.server = None
+        metrics.setGauge('taraf_active_tables', self.__len__)
+        metrics.setGauge('taraf_workers', lambda: sum(1 for worker in self.workers if worker))
+
+    def get(self, ctx):
+        return RemoteTable(self, self.getKey(ctx), ctx, False)
+
+    def getOrOpen(self, ctx):
+        return RemoteTable(self, self.getKey(ctx), ctx, True)
+
+    def close(self, key, removeJournal=False):
+        self.callbacks.pop(key, None)
+        worker = self.workers[getWorkerIndex(key, self.nbOfWorkers)]
+        if worker:
+            worker.notify({'op': 'close', 'key': key, 'removeJournal': removeJournal})
+
+    # Starts the workers, which reopen their tables from the journals
+    async def recover(self, getUser):
+        self.getUser = getUser
+        self.path = os.path.join(tempfile.mkdtemp(prefix='taraf-'), 'workers.sock')
+        self.server = await asyncio.start_unix_server(self.__accept, self.path, limit=MAX_LINE)
+        for index in range(self.nbOfWorkers):
+            self.__spawn(index)
+        await asyncio.wait_for(asyncio.gather(*self.ready), START_TIMEOUT)
+
+    def __spawn(self, index):
+        self.ready[index] = asyncio.get_event_loop().create_future()
+        # a restarted worker is told which of its tables a tournament waits for
+        process = CONTEXT.Process(target=runWorker, args=(index, self.nbOfWorkers, self.path, self.directory,
+                                                          list(self.callbacks)),
+                                  name='taraf-worker-' + str(index), daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def __accept(self, reader, writer):
+        connection = Connection(reader, writer, lambda message: self.__handle(connection, message))
+        connection.index = None
+        connection.task.add_done_callback(lambda task: self.__onClosed(connection, task))
+
+    def __onClosed(self, connection, task):
+        if not task.cancelled():  # cancelled when the bot stops
+            asyncio.ensure_future(self.__restart(connection))
+
+    async def __restart(self, connection):
+        index = connection.index
+        if index is not None and self.workers[index] is connection:
+            self.workers[index] = None
+            self.counts[index] = 0
+            process = self.processes[index]
+            if process.is_alive():
+                process.kill()  # two workers must never own the same journals
+            await asyncio.get_event_loop().run_in_executor(None, process.join)
+            print("Worker " + str(index) + " arrêté (" + str(process.exitcode) + "), redémarrage")
+            self.__spawn(index)
+
+    async def __getWorker(self, key):
+        index = getWorkerIndex(key, self.nbOfWorkers)
+        if self.workers[index] is None:
+            await asyncio.shield(self.ready[index])
+        return index, self.workers[index]
+
+    async def submit(self, table, name, args):
+        index, worker = await self.__getWorker(table.key)
+        self.counts[index] = await worker.request({
+            'op': 'command',
+            'name': name,
+            'open': table.canOpen,
+            'ctx': self.__encodeContext(table.ctx),
+            'args': [self.__encode(table, arg) for arg in args],
+        })
+
+    def __encodeUser(self, user):
+        remember(self.users, user.id, user)
+        return [user.id, user.name]
+
+    def __encodeContext(self, ctx):
+        channel = ctx.message.channel
+        remember(self.channels, channel.id, channel)
+        return {'guild': ctx.guild.id if ctx.guild else None,
+                'channel': [channel.id, getattr(channel, 'name', None)],
+                'author': self.__encodeUser(ctx.message.author)}
+
+    # A command gets a context, a list of users or a callback besides plain values
+    def __encode(self, table, arg):
+        if hasattr(arg, 'message') and hasattr(arg, 'guild'):
+            return {'ctx': self.__encodeContext(arg)}
+        if isinstance(arg, list):
+            return {'users': [self.__encodeUser(user) for user in arg]}
+        if callable(arg):
+            self.callbacks[table.key] = arg
+            return {'callback': True}
+        return arg
+
+    async def __resolveUser(self, userId):
+        user = self.users.get(userId)
+        if user is None:
+            user = await self.getUser(userId)
+            if user:
+                remember(self.users, userId, user)
+        return user
+
+    async def __handle(self, connection, message):
+        op = message['op']
+        if op == 'send':
+            if message['target'] == 'user':
+                destination = await self.__resolveUser(message['to'])
+                route = dmRoute(destination)
+            else:
+                destination = self.channels.get(message['to'])
+                if destination is None:  # not seen since the bot started
+                    raise MissingMessage("Salon inconnu")
+                route = channelRoute(destination)
+            embed = discord.Embed.from_dict(message['embed']) if message.get('embed') else None
+            sent = await dispatcher.call(route, destination.send, content=message.get('content'), embed=embed)
+            handle = next(self.handles)
+            remember(self.messages, handle, (route, sent))
+            return handle
+        elif op in ('edit', 'delete'):
+            if message['handle'] not in self.messages:
+                raise MissingMessage("Message oublié")
+            route, sent = self.messages[message['handle']]
+            self.messages.move_to_end(message['handle'])
+            if op == 'edit':
+                await dispatcher.call(route, sent.edit, embed=discord.Embed.from_dict(message['embed']))
+            else:
+                self.messages.pop(message['handle'])
+                await dispatcher.call(route, sent.delete)
+        elif op == 'user':
+            user = await self.__resolveUser(message['id'])
+            return user.name if user else None
+        elif op == 'gameOver':
+            callback = self.callbacks.pop(tuple(message['key']), None)  # once per game
+            if callback:
+                callback(GameView(tuple(PlayerView(*player) for player in message['players'])))
+        elif op == 'hello':
+            connection.index = message['worker']
+            self.workers[connection.index] = connection
+            self.counts[connection.index] = message['tables']
+            self.ready[connection.index].set_result(None)
+
+    def __len__(self):
+        return sum(self.counts)
+
+
+# Worker side
+
+# What discord.HTTPException reads from a response
+class RemoteResponse:
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+def toDiscordError(error):
+    response = RemoteResponse(error.status, str(error))
+    if error.status == 404:
+        return discord.NotFound(response, str(error))
+    if error.status == 403:
+        return discord.Forbidden(response, str(error))
+    return discord.HTTPException(response, str(error))
+
+
+def toWire(embed):
+    return embed.to_dict() if embed else None
+
+
+class RemoteGuild:
+    def __init__(self, id):
+        self.id = id
+
+
+class RemoteMessage:
+    def __init__(self, worker, handle):
+        self.worker = worker
+        self.handle = handle
+
+    async def edit(self, embed=None):
+        await self.worker.request({'op': 'edit', 'handle': self.handle, 'embed': toWire(embed)})
+
+    async def delete(self):
+        await self.worker.request({'op': 'delete', 'handle': self.handle})
+
+
+class RemoteChannel:
+    def __init__(self, worker, id, name, guild):
+        self.worker = worker
+        self.id = id
+        self.name = name
+        self.guild = guild
+
+    async def send(self, content=None, embed=None):
+        handle = await self.worker.request({'op': 'send', 'target': 'channel', 'to': self.id,
+                                            'content': content, 'embed': toWire(embed)})
+        return RemoteMessage(self.worker, handle)
+
+
+class RemoteUser:
+    def __init__(self, worker, id, name):
+        self.worker = worker
+        self.id = id
+        self.name = name
+
+    async def send(self, content=None, embed=None):
+        handle = await self.worker.request({'op': 'send', 'target': 'user', 'to': self.id,
+                                            'content': content, 'embed': toWire(embed)})
+        return RemoteMessage(self.worker, handle)
+
+
+RemoteCommandMessage = namedtuple('RemoteCommandMessage', ['channel', 'author'])
+
+
+class RemoteContext:
+    def __init__(self, guild, channel, author):
+        self.guild = guild
+        self.message = RemoteCommandMessage(channel, author)
+
+    async def send(self, *args, **kwargs):
+        return await self.message.channel.send(*args, **kwargs)
+
+
+class Worker:
+    # tournamentKeys are the tables whose game over a tournament of the bot waits for
+    def __init__(self, index, nbOfWorkers, directory, tournamentKeys=()):
+        self.index = index
+        self.nbOfWorkers = nbOfWorkers
+        self.tournamentKeys = {tuple(key) for key in tournamentKeys}
+        self.registry = TableRegistry(directory)
+        self.connection = None
+        self.users = {}
+
+    async def run(self, path):
+        reader, writer = await asyncio.open_unix_connection(path, limit=MAX_LINE)
+        self.connection = Connection(reader, writer, self.handle)
+        dispatcher.forwarding = True  # a 429 is only retried once, by the bot
+        await self.recover()
+        await metrics.start(METRICS_PORT + 1 + self.index if METRICS_PORT else 0)
+        self.connection.notify({'op': 'hello', 'worker': self.index, 'tables': len(self.registry)})
+        await self.connection.task
+        # the bot is gone, what is pending is written before leaving
+        await asyncio.gather(*[table.journal.close() for table in self.registry.tables.values() if table.journal])
+        await leaderboard.flush()
+        await archive.flush()
+        await columnWriter.flush()
+
+    # Reopens the tables of this worker. The tournament tables are told again to
+    # report their game over, which the bot may not have heard of yet.
+    async def recover(self):
+        await self.registry.recover(self.getUser, lambda key: getWorkerIndex(key, self.nbOfWorkers) == self.index)
+        for key in self.tournamentKeys & set(self.registry.tables):
+            table = self.registry.tables[key]
+            table.tournament = True
+            table.theGame.onGameOver = self.getGameOver(table)
+            if table.theGame.state.turnState == TurnState.PLAYING_OVER:
+                table.theGame.onGameOver(table.theGame.state.view())
+
+    # Discord errors of the bot are raised again as discord errors, the games
+    # handle some of them (a deleted message is sent again)
+    async def request(self, message):
+        try:
+            return await self.connection.request(message)
+        except RemoteError as error:
+            raise toDiscordError(error) from None
+
+    def getRemoteUser(self, userId, name):
+        user = self.users.get(userId)
+        if user is None or user.name != name:
+            user = self.users[userId] = RemoteUser(self, userId, name)
+        return user
+
+    async def getUser(self, userId):
+        name = await self.request({'op': 'user', 'id': userId})
+        return self.getRemoteUser(userId, name) if name is not None else None
+
+    def decodeContext(self, wire):
+        guild = RemoteGuild(wire['guild']) if wire['guild'] is not None else None
+        channelId, channelName = wire['channel']
+        return RemoteContext(guild, RemoteChannel(self, channelId, channelName, guild),
+                             self.getRemoteUser(*wire['author']))
+
+    def decode(self, table, arg):
+        if isinstance(arg, dict):
+            if 'ctx' in arg:
+                return self.decodeContext(arg['ctx'])
+            if 'users' in arg:
+                return [self.getRemoteUser(*user) for user in arg['users']]
+            if 'callback' in arg:
+                return self.getGameOver(table)
+        return arg
+
+    def getGameOver(self, table):
+        return lambda view: self.connection.notify({'op': 'gameOver', 'key': table.key, 'players': list(view.players)})
+
+    async def handle(self, message):
+        if message['op'] == 'command':
+            if message['name'] not in COMMANDS:
+                raise ValueError("Commande inconnue : " + message['name'])
+            ctx = self.decodeContext(message['ctx'])
+            table = self.registry.getOrOpen(ctx) if message['open'] else self.registry.get(ctx)
+            if table:
+                command = table
+                for name in message['name'].split('.'):
+                    command = getattr(command, name)
+                if message['name'] == 'seat':
+                    table.tournament = True  # the tournament itself is run by the bot
+                await table.submit(command, *[self.decode(table, arg) for arg in message['args']])
+            return len(self.registry)
+        elif message['op'] == 'close':
+            self.registry.close(tuple(message['key']), message['removeJournal'])
+
+
+def runWorker(index, nbOfWorkers, path, directory, tournamentKeys=()):
+    asyncio.run(Worker(index, nbOfWorkers, directory, tournamentKeys).run(path))